@@ -0,0 +1,279 @@
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+import pygame
+
+from src import core, diagnostics, level_generator, replay, zulu_doodmaak
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TICK = 1000 / 60
+DEFAULT_TICKS = 300
+WARMUP_TICKS = 30
+# ticks of the separate pass that watches allocations, tracemalloc would distort the frame times of the timed one
+ALLOCATION_TICKS = 60
+# metrics where a larger value is better, the rest are costs
+HIGHER_IS_BETTER = {'ticks_per_sec'}
+
+
+class BenchmarkGame(zulu_doodmaak.Generals):
+
+    def __init__(self, window_size=(1280, 720), seed: int = 0, viewport_size=None):
+        super().__init__(window_size, viewport_size or window_size, 'benchmark', 'icon', False, seed)
+
+    def add_controls(self):
+        # created after the level, in the same order as Generals.start, so a replay sees the same object list
+        self.selection = zulu_doodmaak.Selection(self)
+        self.cursor = zulu_doodmaak.Cursor(self)
+
+    def read_input(self):
+        # the dummy video driver reports the mouse at (0, 0), which would scroll the camera
+        return (self.window_size[0] // 2, self.window_size[1] // 2), pygame.key.get_pressed()
+
+
+class Scenario:
+
+    def __init__(self, name: str, setup: Callable, window_size=(1280, 720)):
+        self.name = name
+        self.setup = setup
+        self.window_size = window_size
+
+    def run(self, ticks: int = DEFAULT_TICKS, seed: int = 0, leaks: bool = False) -> Dict[str, float]:
+        game = BenchmarkGame(self.window_size, seed)
+        step = self.setup(game, seed)
+        game.add_controls()
+        tracker = None
+        if leaks:
+            # tracemalloc slows everything down, frame times of a leak run are not comparable
+            tracker = diagnostics.LeakTracker(game, max(1, ticks // 8), report=None)
+            tracker.add_check('dead units', lambda: sum(
+                isinstance(i, zulu_doodmaak.Selectable) and i.hp <= 0 for i in game.game_objects))
+        for _ in range(WARMUP_TICKS):
+            self.tick(game, step)
+        results = measure(game, ticks, lambda: self.tick(game, step))
+        results.update(measure_allocations(min(ticks, ALLOCATION_TICKS), lambda: self.tick(game, step)))
+        if tracker is not None:
+            results['leaks'] = tracker.warnings
+        return results
+
+    @staticmethod
+    def tick(game: BenchmarkGame, step: Callable or None):
+        if step is not None:
+            step(game)
+        game.frame(TICK, (10, 255, 255))
+
+
+def measure(game: BenchmarkGame, ticks: int, tick: Callable) -> Dict[str, float]:
+    frame_times = []
+    blocks = sys.getallocatedblocks()
+    started = time.perf_counter()
+    for _ in range(ticks):
+        frame_started = time.perf_counter()
+        tick()
+        frame_times.append((time.perf_counter() - frame_started) * 1000)
+    elapsed = time.perf_counter() - started
+    return {
+        'ticks': ticks,
+        'ticks_per_sec': ticks / elapsed,
+        'frame_p50': core.percentile(frame_times, 50),
+        'frame_p95': core.percentile(frame_times, 95),
+        'frame_p99': core.percentile(frame_times, 99),
+        # net growth of live Python allocations, not how many were made, a leak shows up as a steady positive value
+        'block_growth_per_tick': (sys.getallocatedblocks() - blocks) / ticks,
+        'objects': len(game.game_objects),
+        'active_objects': len(game.active_objects),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def measure_allocations(ticks: int, tick: Callable) -> Dict[str, float]:
+    """How much memory the ticks allocate, including what they free again before they end.
+
+    sys.getallocatedblocks() only shows what a tick keeps. The peak traced by tracemalloc above the start of a tick
+    also counts the temporaries that are alive together, like the lists and surfaces of a frame, so allocation heavy
+    code shows up even when it does not grow. Temporaries freed before the next one is made only count once.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    peaks = []
+    for _ in range(ticks):
+        tracemalloc.reset_peak()
+        started = tracemalloc.get_traced_memory()[0]
+        tick()
+        peaks.append(tracemalloc.get_traced_memory()[1] - started)
+    if not tracing:
+        tracemalloc.stop()
+    return {
+        'alloc_peak_kb_per_tick': sum(peaks) / max(1, ticks) / 1024,
+        'alloc_peak_kb_p95': core.percentile(peaks, 95) / 1024,
+    }
+
+
+def replay_game(recording: replay.Replay) -> BenchmarkGame:
+    game = BenchmarkGame(recording.window_size, recording.seed, recording.viewport_size)
+    zulu_doodmaak.load_level(game, recording.level)
+    game.add_controls()
+    game.play(recording)
+    return game
+
+
+def run_replay(path: str) -> Dict[str, float]:
+    # a recorded match is the closest thing to a real session, with the recorded deltas instead of TICK
+    recording = replay.Replay.load(path)
+    game = replay_game(recording)
+    results = measure(game, len(recording), lambda: game.frame(0, zulu_doodmaak.FILL))
+    # the replay is over, the allocation pass plays its start again in a game of its own
+    game = replay_game(recording)
+    results.update(measure_allocations(min(len(recording), ALLOCATION_TICKS),
+                                       lambda: game.frame(0, zulu_doodmaak.FILL)))
+    return results
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def load(game, level):
+    zulu_doodmaak.create_level(game, level)
+
+
+def idle_economy(game, seed):
+    load(game, level_generator.generate_preset('1k', seed, clusters=20))
+
+
+def mass_harvest(game, seed):
+    # every slave belongs to the bot, so each of them looks for a free collectable
+    generator = level_generator.LevelGenerator(4096, 2560, seed, 2, [0, 1], clusters=10, army_radius=600)
+    load(game, generator.generate({0: 300, 1: 200, 2: 200, 3: 100, 4: 200}, {}, {0: 400}))
+
+
+def lancer_brawl(game, seed):
+    generator = level_generator.LevelGenerator(2048, 1280, seed, 2, army_radius=120)
+    generator.bases = [(900, 640), (1150, 640)]
+    load(game, generator.generate({}, {}, {1: 300, 2: 100}))
+    game.camera.center = 1024, 640
+
+
+def particle_storm(game, seed):
+    generator = level_generator.LevelGenerator(2048, 1280, seed, 2, army_radius=300)
+    load(game, generator.generate({0: 100}, {}, {0: 100, 1: 100}))
+    units = [i for i in game.game_objects if isinstance(i, zulu_doodmaak.Unit)]
+    game.camera.center = generator.bases[0]
+
+    def step(game):
+        for unit in units[step.index:step.index + 2]:
+            game.blood.play_at(unit.rect.center, unit.rect)
+        step.index = (step.index + 2) % len(units)
+
+    step.index = 0
+    return step
+
+
+def camera_pan(game, seed):
+    load(game, level_generator.generate_preset('1k', seed, clusters=20))
+    game.camera.topleft = 0, 0
+
+    def step(game):
+        camera = game.camera
+        camera.move(step.dx, step.dy)
+        if camera.right >= camera.max_x or camera.x <= camera.min_x:
+            step.dx = -step.dx
+        if camera.bottom >= camera.max_y or camera.y <= camera.min_y:
+            step.dy = -step.dy
+
+    step.dx, step.dy = 12, 7
+    return step
+
+
+SCENARIOS = {i.name: i for i in [
+    Scenario('idle_economy', idle_economy),
+    Scenario('mass_harvest', mass_harvest),
+    Scenario('lancer_brawl', lancer_brawl),
+    Scenario('particle_storm', particle_storm),
+    *(Scenario(f'camera_pan_{name}', camera_pan, size) for name, size in zulu_doodmaak.RESOLUTIONS.items()),
+]}
+
+
+def run_isolated(name: str, ticks: int, seed: int, leaks: bool = False, replay_path: str = None) -> Dict[str, float]:
+    # one process per scenario, so peak RSS and the module level caches belong to it alone
+    command = [sys.executable, '-m', 'src.benchmark', '--child', name, '--ticks', str(ticks), '--seed', str(seed)]
+    if leaks:
+        command.append('--leaks')
+    if replay_path:
+        command += ['--replay', replay_path]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict]) -> str:
+    lines = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, value in metrics.items():
+            old = baseline[name].get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old * 100
+            better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+            mark = '' if abs(change) < 5 else (' better' if better else ' WORSE')
+            lines.append(f'{name:24} {metric:16} {old:12.2f} -> {value:12.2f} {change:+7.1f}%{mark}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the headless scenario benchmarks')
+    parser.add_argument('scenarios', nargs='*', help=f'default: all of {", ".join(SCENARIOS)}')
+    parser.add_argument('--ticks', type=int, default=DEFAULT_TICKS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json', help='where the results are written')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--leaks', action='store_true', help='soak run with leak tracking, slows the ticks down')
+    parser.add_argument('--replay', help='benchmark a recorded match instead of the scenarios')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        pygame.init()
+        if args.replay:
+            print(json.dumps(run_replay(args.replay)))
+        else:
+            print(json.dumps(SCENARIOS[args.child].run(args.ticks, args.seed, args.leaks)))
+        return
+
+    results = {}
+    names = [f'replay_{os.path.basename(args.replay)}'] if args.replay else args.scenarios or SCENARIOS
+    for name in names:
+        results[name] = run_isolated(name, args.ticks, args.seed, args.leaks, args.replay)
+        metrics = results[name]
+        print(f'{name:24} {metrics["ticks_per_sec"]:8.1f} ticks/s  p50 {metrics["frame_p50"]:6.2f} ms  '
+              f'p95 {metrics["frame_p95"]:6.2f} ms  p99 {metrics["frame_p99"]:6.2f} ms')
+        for warning in metrics.get('leaks', ()):
+            print(f'    {warning}')
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            print(compare(results, json.load(file)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+from typing import List, Tuple
+
+import numpy as np
+import pygame
+
+from src import core
+
+# posted on the game's bus with attacker, target and amount
+DAMAGE = pygame.USEREVENT + 2
+# posted on the game's bus with unit and killer, after the DAMAGE that killed it
+DEATH = pygame.USEREVENT + 3
+
+
+class Combat(core.Object):
+    """Hit points and attack cooldowns of every fighter, with the attacks of a tick resolved together.
+
+    Fighters declare attacks while they are processed, the next run of the combat applies all of them in one pass
+    over the arrays and posts the damage and death events. Attacks of the same tick land at the same time, so two
+    fighters can kill each other.
+    """
+
+    def __init__(self, game: core.Game, capacity: int = 256):
+        super().__init__(game)
+        # a removed fighter leaves None behind, its index is reused by the next one added
+        self.fighters: List = []
+        self.free: List[int] = []
+        self.hp = np.zeros(capacity, np.int32)
+        self.attack = np.zeros(capacity, np.int32)
+        self.interval = np.zeros(capacity, np.float64)
+        # game time of the next attack every fighter may make
+        self.ready = np.zeros(capacity, np.float64)
+        self.intents: List[Tuple[int, int]] = []
+        self.hits = 0
+
+    def add(self, fighter, hp: int, attack: int = 0, interval: float = 0) -> int:
+        """Registers fighter and returns its index into the arrays."""
+        if self.free:
+            index = self.free.pop()
+            self.fighters[index] = fighter
+        else:
+            index = len(self.fighters)
+            if index == len(self.hp):
+                size = 2 * index
+                self.hp = np.resize(self.hp, size)
+                self.attack = np.resize(self.attack, size)
+                self.interval = np.resize(self.interval, size)
+                self.ready = np.resize(self.ready, size)
+            self.fighters.append(fighter)
+        self.hp[index] = hp
+        self.attack[index] = attack
+        self.interval[index] = interval
+        self.ready[index] = 0
+        return index
+
+    def remove(self, index: int):
+        """Releases the slot of a dead fighter, so nothing here keeps it alive."""
+        self.fighters[index] = None
+        self.hp[index] = 0
+        # attacks declared this tick by or on it must not land on the next fighter to take the slot
+        self.intents = [i for i in self.intents if index not in i]
+        self.free.append(index)
+
+    def strike(self, attacker: int, target: int):
+        # only an intent, whether it lands is decided when the tick's attacks are resolved
+        self.intents.append((attacker, target))
+
+    def process(self, delta: float) -> None:
+        if not self.intents:
+            self.hits = 0
+            return
+        attackers, targets = np.array(self.intents, np.intp).T
+        self.intents = []
+        now = self.game.scheduler.time
+        hits = (self.ready[attackers] <= now) & (self.hp[attackers] > 0) & (self.hp[targets] > 0)
+        attackers, targets = attackers[hits], targets[hits]
+        self.hits = len(attackers)
+        if not self.hits:
+            return
+        amounts = self.attack[attackers]
+        before = self.hp[targets]
+        np.subtract.at(self.hp, targets, amounts)
+        self.ready[attackers] = now + self.interval[attackers]
+
+        fighters, bus = self.fighters, self.game.bus
+        for attacker, target, amount in zip(attackers.tolist(), targets.tolist(), amounts.tolist()):
+            bus.post(pygame.event.Event(DAMAGE, attacker=fighters[attacker], target=fighters[target], amount=amount))
+        # the first attacker of a target that died this tick gets the kill
+        killed, first = np.unique(targets, return_index=True)
+        dead = (self.hp[killed] <= 0) & (before[first] > 0)
+        for target, attacker in zip(killed[dead].tolist(), attackers[first[dead]].tolist()):
+            bus.post(pygame.event.Event(DEATH, unit=fighters[target], killer=fighters[attacker]))
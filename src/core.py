@@ -1,14 +1,45 @@
+import heapq
+import json
+import math
+import operator
 import os
-from typing import List, Dict
+import random
+import time
+from collections import deque
+from typing import List, Dict, Tuple, Callable, Iterator
 
 import pygame
 import simpleaudio
 from pygame import Surface
 
+from src import replay
+
 ANIMATION_TAGS = {
     'loop': 1
 }
 
+INPUT_EVENTS = {
+    pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEWHEEL,
+    pygame.KEYDOWN, pygame.KEYUP,
+}
+
+
+MUSIC_END = pygame.USEREVENT + 1
+PROFILER_KEY = pygame.K_F2
+TRACE_KEY = pygame.K_F4
+PAUSE_KEY = pygame.K_PAUSE
+
+
+creation_order = operator.attrgetter('seq')
+
+
+def percentile(values, p: float):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[index]
+
 
 class Rect(pygame.Rect):
 
@@ -40,10 +71,177 @@ class Vector2:
 
 
 class Collider(Rect):
-    pass
+    """The rect of an object in the collision world.
+
+    Two colliders touch when the layer of each is in the mask of the other, the owner is told how far to move apart.
+    """
+
+    def __init__(self, owner, rect, layer: int = 1, mask: int = ~0):
+        super().__init__(rect)
+        self.owner = owner
+        self.layer = layer
+        self.mask = mask
+
+
+class CollisionWorld:
+    """Separates overlapping colliders a little every tick, so crowds spread out instead of being shoved around.
+
+    The broadphase buckets the colliders by the cells their rects touch, so only neighbours are compared and a pair is
+    separated once, in the cell that holds the corner of their overlap.
+    """
+
+    def __init__(self, cell_size: int = 64, speed: float = 60):
+        self.cell_size = cell_size
+        # pixels per second a collider is moved at most to get out of the others
+        self.speed = speed
+        self.colliders: Dict[int, Collider] = {}
+        self.checks = 0
+        self.contacts = 0
+
+    def __len__(self):
+        return len(self.colliders)
+
+    def add(self, collider: Collider):
+        self.colliders[id(collider)] = collider
+
+    def remove(self, collider: Collider):
+        self.colliders.pop(id(collider), None)
+
+    def pairs(self) -> Iterator[Tuple[Collider, Collider]]:
+        size = self.cell_size
+        cells: Dict[Tuple[int, int], List[Collider]] = {}
+        for collider in self.colliders.values():
+            for x in range(collider.left // size, (collider.right - 1) // size + 1):
+                for y in range(collider.top // size, (collider.bottom - 1) // size + 1):
+                    cells.setdefault((x, y), []).append(collider)
+        self.checks = 0
+        for key, cell in cells.items():
+            for i, a in enumerate(cell):
+                for b in cell[i + 1:]:
+                    self.checks += 1
+                    if not (a.layer & b.mask and b.layer & a.mask) or not a.colliderect(b):
+                        continue
+                    if (max(a.left, b.left) // size, max(a.top, b.top) // size) == key:
+                        yield a, b
+
+    def step(self, delta: float):
+        pushes: Dict[int, List[float]] = {}
+        contacts = 0
+        for a, b in self.pairs():
+            contacts += 1
+            depth = min(a.right, b.right) - max(a.left, b.left), min(a.bottom, b.bottom) - max(a.top, b.top)
+            dx, dy = b.centerx - a.centerx, b.centery - a.centery
+            if not dx and not dy:
+                # on top of each other, the one created later steps aside
+                dx = 1
+            length = math.hypot(dx, dy)
+            force = min(depth) / 2 / length
+            push_a = pushes.setdefault(id(a), [0, 0])
+            push_b = pushes.setdefault(id(b), [0, 0])
+            push_a[0] -= dx * force
+            push_a[1] -= dy * force
+            push_b[0] += dx * force
+            push_b[1] += dy * force
+        self.contacts = contacts
+        limit = self.speed * delta / 1000
+        colliders = self.colliders
+        for key, (dx, dy) in pushes.items():
+            length = math.hypot(dx, dy)
+            if length > limit:
+                dx, dy = dx * limit / length, dy * limit / length
+            if dx or dy:
+                colliders[key].owner.separate(dx, dy)
+
+
+class SpatialHash:
+    """Buckets objects by the cell of a point, a query returns the objects of every cell a rect touches."""
+
+    def __init__(self, cell_size: int = 256):
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int], Dict[object, None]] = {}
+        self.keys: Dict[object, Tuple[int, int]] = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, obj):
+        return obj in self.keys
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def cell(self, point) -> Tuple[int, int]:
+        return int(point[0] // self.cell_size), int(point[1] // self.cell_size)
+
+    def insert(self, obj, point):
+        key = self.cell(point)
+        if self.keys.get(obj) == key:
+            return
+        self.remove(obj)
+        self.keys[obj] = key
+        self.cells.setdefault(key, {})[obj] = None
+
+    def remove(self, obj):
+        key = self.keys.pop(obj, None)
+        if key is not None:
+            cell = self.cells[key]
+            del cell[obj]
+            if not cell:
+                del self.cells[key]
+
+    def query(self, rect: pygame.Rect, margin: int = 0) -> Iterator:
+        left, top = self.cell((rect.left - margin, rect.top - margin))
+        right, bottom = self.cell((rect.right + margin, rect.bottom + margin))
+        cells = self.cells
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                cell = cells.get((x, y))
+                if cell:
+                    yield from cell
+
+    def ring(self, center: Tuple[int, int], radius: int) -> Iterator[Tuple[int, int]]:
+        cx, cy = center
+        if radius == 0:
+            yield center
+            return
+        for x in range(cx - radius, cx + radius + 1):
+            yield x, cy - radius
+            yield x, cy + radius
+        for y in range(cy - radius + 1, cy + radius):
+            yield cx - radius, y
+            yield cx + radius, y
+
+    def nearest(self, point, max_distance: float, distance: Callable, margin: float = 0):
+        """The object with the smallest distance(obj) below max_distance, or None.
+
+        Cells are searched in rings around point, until a ring cannot hold anything closer. margin is how much
+        distance() may be smaller than the distance between point and the object's cell, e.g. half the sizes.
+        Ties go to the object created first.
+        """
+        center = self.cell(point)
+        cells = self.cells
+        best, best_key = None, (max_distance, -1)
+        radius = 0
+        while (radius - 1) * self.cell_size - margin < best_key[0]:
+            for key in self.ring(center, radius):
+                cell = cells.get(key)
+                if not cell:
+                    continue
+                for obj in cell:
+                    obj_key = distance(obj), obj.seq
+                    if obj_key < best_key:
+                        best, best_key = obj, obj_key
+            radius += 1
+        return best
 
 
 class AbstractObject:
+    events: Tuple[int, ...] = ()
+    alive: bool = True
+    # asleep objects are skipped by the update loop until something wakes them
+    asleep: bool = False
+    # creation order, the update loop keeps the awake objects sorted by it
+    seq: int = 0
 
     def _process(self, delta: float) -> None:
         self.process(delta)
@@ -62,7 +260,193 @@ class Object(AbstractObject):
 
     def __init__(self, game: 'Game'):
         self.game: 'Game' = game
-        self.game.game_objects.append(self)
+        self.game.create_object(self)
+
+    def kill(self):
+        self.game.remove_object(self)
+
+    def sleep(self, visible: bool = True):
+        self.game.sleep(self, visible)
+
+    def wake(self):
+        self.game.wake(self)
+
+
+class EventBus:
+
+    def __init__(self, profiler: 'Profiler' = None):
+        self.handlers: Dict[int, List[Callable]] = {}
+        self.motion = None
+        self.profiler = profiler
+
+    def subscribe(self, event_type: int, handler: Callable):
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    def unsubscribe(self, event_type: int, handler: Callable):
+        handlers = self.handlers.get(event_type)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+
+    def post(self, event):
+        if event.type == pygame.MOUSEMOTION:
+            self.motion = event
+            return
+        # pending motion goes first, so a click sees the hover state it was made in
+        self.flush()
+        self.dispatch(event)
+
+    def flush(self):
+        if self.motion is not None:
+            event, self.motion = self.motion, None
+            self.dispatch(event)
+
+    def dispatch(self, event):
+        handlers = self.handlers.get(event.type)
+        if not handlers:
+            return
+        if self.profiler is not None and self.profiler.enabled:
+            for handler in tuple(handlers):
+                started = time.perf_counter()
+                handler(event)
+                self.profiler.add(type(getattr(handler, '__self__', handler)).__name__, 'event', time.perf_counter() - started)
+        else:
+            for handler in tuple(handlers):
+                handler(event)
+
+
+class Timer:
+    __slots__ = ('time', 'callback', 'args', 'cancelled')
+
+    def __init__(self, time: float, callback: Callable, args: tuple):
+        self.time = time
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """Runs callbacks at absolute game times, nothing is done for a timer until it is due."""
+
+    def __init__(self):
+        # game time in milliseconds, it stands still while paused and runs faster with a larger scale
+        self.time: float = 0
+        self.scale: float = 1
+        self.paused = False
+        # (time, sequence, timer), the sequence keeps timers due at the same time in the order they were added
+        self.queue: List[Tuple[float, int, Timer]] = []
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def at(self, time: float, callback: Callable, *args) -> Timer:
+        timer = Timer(time, callback, args)
+        heapq.heappush(self.queue, (time, self.sequence, timer))
+        self.sequence += 1
+        return timer
+
+    def after(self, delay: float, callback: Callable, *args) -> Timer:
+        return self.at(self.time + delay, callback, *args)
+
+    def toggle_pause(self):
+        self.paused = not self.paused
+
+    def advance(self, delta: float) -> float:
+        """Moves game time forward by the real delta and returns the game delta."""
+        delta = 0 if self.paused else delta * self.scale
+        self.time += delta
+        queue = self.queue
+        while queue and queue[0][0] <= self.time:
+            timer = heapq.heappop(queue)[2]
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+        return delta
+
+
+class Task:
+    __slots__ = ('callback', 'args', 'interval', 'cancelled')
+
+    def __init__(self, callback: Callable, args: tuple, interval: float):
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        # the task stays queued until its turn comes, but lets go of its arguments right away
+        self.cancelled = True
+        self.args = ()
+
+
+class TaskScheduler:
+    """Runs periodic tasks round-robin in game time, no more of them per frame than the budget allows."""
+    # initial delays are spread over this many slots of the interval, so tasks added together do not run together
+    stagger: int = 8
+
+    def __init__(self, clock: Scheduler, budget: float or None = 2, limit: int or None = 64):
+        self.clock = clock
+        # wall time per frame in milliseconds and number of tasks per frame, None for no limit
+        self.budget = budget
+        self.limit = limit
+        self.queue: List[Tuple[float, int, Task]] = []
+        self.sequence = 0
+        # tasks run in the last frame and tasks left overdue after it
+        self.ran = 0
+        self.late = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def add(self, callback: Callable, interval: float, *args, delay: float = None) -> Task:
+        """Calls callback(*args) every interval, until it returns False or the task is cancelled."""
+        if delay is None:
+            delay = interval * (self.sequence % self.stagger) / self.stagger
+        task = Task(callback, args, interval)
+        self.push(task, self.clock.time + delay)
+        return task
+
+    def push(self, task: Task, due: float):
+        heapq.heappush(self.queue, (due, self.sequence, task))
+        self.sequence += 1
+
+    def run(self):
+        now = self.clock.time
+        queue = self.queue
+        deadline = None if self.budget is None else time.perf_counter() + self.budget / 1000
+        ran = 0
+        while queue and queue[0][0] <= now:
+            if self.limit is not None and ran >= self.limit:
+                break
+            # at least one task runs every frame, so a slow task cannot starve the others
+            if deadline is not None and ran and time.perf_counter() >= deadline:
+                break
+            task = heapq.heappop(queue)[2]
+            if task.cancelled:
+                continue
+            ran += 1
+            if task.callback(*task.args) is not False and not task.cancelled:
+                self.push(task, now + task.interval)
+        self.ran = ran
+        self.late = self.overdue(now)
+
+    def overdue(self, now: float) -> int:
+        """The number of queued tasks due by now, the children of a heap entry are never due before it.
+
+        Only the overdue part of the heap is walked, so this costs nothing while the scheduler keeps up.
+        """
+        queue = self.queue
+        count = 0
+        stack = [0] if queue and queue[0][0] <= now else []
+        while stack:
+            i = stack.pop()
+            count += 1
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(queue) and queue[child][0] <= now:
+                    stack.append(child)
+        return count
 
 
 class Animation:
@@ -97,30 +481,204 @@ class Sound:
     channel: pygame.mixer.Channel = None
 
     def set_volume(self, volume: int):
-        self.channel.set_volume(volume)
+        if self.channel is not None:
+            self.channel.set_volume(volume)
 
     def get_volume(self):
-        self.channel.get_volume()
+        if self.channel is not None:
+            return self.channel.get_volume()
 
-    def __init__(self, sound: pygame.mixer.Sound):
+    def __init__(self, sound: pygame.mixer.Sound, mixer: 'Mixer' = None, group: str = None, priority: int = 0):
         self.sound = sound
+        self.mixer = mixer
+        self.group = group
+        self.priority = priority
 
     def play(self):
-        if self.channel is None:
-            self.channel = pygame.mixer.find_channel()
-        if self.channel is None:
-            pygame.mixer.set_num_channels(pygame.mixer.get_num_channels() + 1)
+        if self.mixer is not None:
+            self.channel = self.mixer.play(self)
+        else:
             self.channel = pygame.mixer.find_channel()
-        self.channel.play(self.sound)
+            if self.channel is not None:
+                self.channel.play(self.sound)
+        return self.channel
+
+    def play_at(self, point, volume: float = 1):
+        if self.mixer is not None:
+            self.mixer.emit(self, point, volume)
+        else:
+            self.play()
 
     def pause(self):
-        self.channel.pause()
+        if self.channel is not None:
+            self.channel.pause()
 
     def unpause(self):
-        self.channel.unpause()
+        if self.channel is not None:
+            self.channel.unpause()
 
     def stop(self):
-        self.channel.stop()
+        if self.channel is not None:
+            self.channel.stop()
+
+
+class SoundGroup:
+
+    def __init__(self, name: str, limit: int, cooldown: int = 0):
+        self.name = name
+        self.limit = limit
+        self.cooldown = cooldown
+        self.last_play = None
+
+
+class Mixer:
+    audible_scale: float = 1.5
+    merge_gain: float = 0.25
+
+    def __init__(self, voices: int = 16, camera: 'Camera' = None):
+        self.camera = camera
+        self.pending: Dict[object, list] = {}
+        self.voices = voices if pygame.mixer.get_init() else 0
+        if self.voices:
+            pygame.mixer.set_num_channels(self.voices)
+        self.channels = [pygame.mixer.Channel(i) for i in range(self.voices)]
+        self.playing: List[Sound or None] = [None] * self.voices
+        self.started: List[int] = [0] * self.voices
+        self.groups: Dict[str, SoundGroup] = {}
+
+    def add_group(self, name: str, limit: int, cooldown: int = 0):
+        self.groups[name] = SoundGroup(name, limit, cooldown)
+
+    def busy_voices(self):
+        return [i for i in range(self.voices) if self.playing[i] is not None and self.channels[i].get_busy()]
+
+    def steal(self, voices, priority: int):
+        # the lowest priority voice loses, the oldest one among equals
+        candidates = [i for i in voices if self.playing[i].priority <= priority]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: (self.playing[i].priority, self.started[i]))
+
+    def play(self, sound: Sound) -> pygame.mixer.Channel or None:
+        if not self.voices:
+            return None
+        now = pygame.time.get_ticks()
+        busy = self.busy_voices()
+        group = self.groups.get(sound.group)
+        voice = None
+        if group is not None:
+            if group.last_play is not None and now - group.last_play < group.cooldown:
+                return None
+            in_group = [i for i in busy if self.playing[i].group == group.name]
+            if len(in_group) >= group.limit:
+                voice = self.steal(in_group, sound.priority)
+                if voice is None:
+                    return None
+        if voice is None:
+            free = [i for i in range(self.voices) if i not in busy]
+            voice = free[0] if free else self.steal(busy, sound.priority)
+        if voice is None:
+            return None
+        if group is not None:
+            group.last_play = now
+        channel = self.channels[voice]
+        channel.play(sound.sound)
+        channel.set_volume(1)
+        self.playing[voice] = sound
+        self.started[voice] = now
+        return channel
+
+    def audible_radius(self):
+        return math.hypot(self.camera.w, self.camera.h) / 2 * self.audible_scale
+
+    def emit(self, sound: Sound, point, volume: float = 1):
+        if self.camera is None:
+            sound.play()
+            return
+        dx = point[0] - self.camera.centerx
+        dy = point[1] - self.camera.centery
+        radius = self.audible_radius()
+        distance = math.hypot(dx, dy)
+        if distance >= radius or not self.voices:
+            return
+        volume *= 1 - distance / radius
+        # emitters of one group heard in the same frame become one voice
+        key = sound.group if sound.group is not None else sound
+        self.pending.setdefault(key, []).append((sound, dx, volume))
+
+    def flush(self):
+        if not self.pending:
+            return
+        radius = self.audible_radius()
+        for emitters in self.pending.values():
+            sound, dx, volume = max(emitters, key=lambda i: i[2])
+            volume = min(1, volume * (1 + self.merge_gain * math.log2(len(emitters))))
+            pan = sum(i[1] for i in emitters) / len(emitters) / radius
+            pan = max(-1, min(1, pan))
+            channel = self.play(sound)
+            if channel is not None:
+                sound.channel = channel
+                channel.set_volume(volume * min(1, 1 - pan), volume * min(1, 1 + pan))
+        self.pending = {}
+
+
+class Music(Object):
+    events = (MUSIC_END,)
+
+    def __init__(self, game: 'Game', fade_ms: int = 2000, volume: float = 1):
+        super().__init__(game)
+        self.fade_ms = fade_ms
+        self.volume = volume
+        self.playlist: List[str] = []
+        self.current: int = -1
+        self.loop = True
+        self.stopped = True
+        pygame.mixer.music.set_endevent(MUSIC_END)
+
+    def set_playlist(self, names: List[str], loop: bool = True):
+        self.playlist = list(names)
+        self.loop = loop
+        self.current = -1
+
+    def set_volume(self, volume: float):
+        self.volume = volume
+        if pygame.mixer.get_init():
+            pygame.mixer.music.set_volume(volume)
+
+    def play(self, index: int = 0):
+        if not self.playlist or not pygame.mixer.get_init():
+            return
+        self.current = index % len(self.playlist)
+        self.stopped = False
+        # the track is decoded in small chunks by SDL_mixer while it plays
+        pygame.mixer.music.load(self.game.resources.music[self.playlist[self.current]])
+        pygame.mixer.music.set_volume(self.volume)
+        pygame.mixer.music.play(0, 0, self.fade_ms)
+
+    def next(self):
+        if not self.playlist or not pygame.mixer.get_init():
+            return
+        if self.stopped or not pygame.mixer.music.get_busy():
+            self.advance()
+        else:
+            # the next track starts from MUSIC_END once the fade out is over
+            pygame.mixer.music.fadeout(self.fade_ms)
+
+    def advance(self):
+        index = self.current + 1
+        if index >= len(self.playlist) and not self.loop:
+            self.stopped = True
+            return
+        self.play(index)
+
+    def stop(self):
+        self.stopped = True
+        if pygame.mixer.get_init():
+            pygame.mixer.music.fadeout(self.fade_ms)
+
+    def event(self, event) -> None:
+        if not self.stopped:
+            self.advance()
 
 
 class SimpleSound(Object):
@@ -144,12 +702,178 @@ class SimpleSound(Object):
             self.sound.stop()
 
 
+class LatencyMonitor:
+    """Milliseconds from an input event entering the queue to the flip of the frame that applied it.
+
+    pygame events carry no timestamp, so an event is taken to have arrived right after the previous poll of the
+    queue. A sample is the worst case for its event: the time it waited in the queue, the clock's sleep included,
+    plus the frame's work.
+    """
+
+    def __init__(self, size: int = 1000):
+        self.samples = deque(maxlen=size)
+        self.pending: List[float] = []
+        self.polled: float or None = None
+        # the previous poll, the earliest the events of the current one can have arrived
+        self.since: float = 0
+
+    def poll(self):
+        now = time.perf_counter()
+        self.since = self.polled if self.polled is not None else now
+        self.polled = now
+
+    def input(self, event):
+        if event.type in INPUT_EVENTS:
+            self.pending.append(self.since)
+
+    def present(self):
+        if not self.pending:
+            return
+        now = time.perf_counter()
+        self.samples.extend((now - i) * 1000 for i in self.pending)
+        self.pending = []
+
+    def percentiles(self, ps=(50, 95, 99)) -> Dict[int, float]:
+        return {p: percentile(self.samples, p) for p in ps}
+
+    def report(self) -> str:
+        values = ', '.join(f'p{p}={v:.1f}ms' for p, v in self.percentiles().items())
+        return f'input latency ({len(self.samples)} events): {values}'
+
+
+class Profiler:
+    kinds = ('process', 'event', 'draw')
+
+    def __init__(self, window: int = 120):
+        self.enabled = False
+        # frames aggregated into one rolling summary
+        self.window = window
+        self.frames = 0
+        self.classes: Dict[str, Dict[str, list]] = {}
+        self.phases: Dict[str, float] = {}
+        self.summary: dict = {}
+
+    def enable(self):
+        self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def reset(self):
+        self.frames = 0
+        self.classes = {}
+        self.phases = {}
+
+    def add(self, name: str, kind: str, elapsed: float):
+        counters = self.classes.get(name)
+        if counters is None:
+            counters = self.classes[name] = {i: [0, 0] for i in self.kinds}
+        counter = counters[kind]
+        counter[0] += elapsed
+        counter[1] += 1
+
+    def phase(self, name: str, elapsed: float):
+        self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def end_frame(self):
+        self.frames += 1
+        if self.frames >= self.window:
+            self.summary = self.stats()
+            self.reset()
+
+    def stats(self) -> dict:
+        frames = max(1, self.frames)
+        return {
+            'frames': self.frames,
+            # milliseconds per frame
+            'phases': {name: elapsed * 1000 / frames for name, elapsed in self.phases.items()},
+            'classes': {
+                name: {kind: {'ms': elapsed * 1000 / frames, 'calls': calls / frames}
+                       for kind, (elapsed, calls) in counters.items() if calls}
+                for name, counters in self.classes.items()
+            },
+        }
+
+    def report(self, top: int = 15) -> str:
+        stats = self.summary or self.stats()
+        lines = [f"profile over {stats['frames']} frames, ms per frame"]
+        lines.extend(f'  {name:16} {ms:8.3f}' for name, ms in stats['phases'].items())
+        classes = sorted(stats['classes'].items(), key=lambda i: -sum(j['ms'] for j in i[1].values()))
+        for name, kinds in classes[:top]:
+            values = '  '.join(f"{kind} {value['ms']:.3f} ({value['calls']:.0f})" for kind, value in kinds.items())
+            lines.append(f'  {name:24} {values}')
+        return '\n'.join(lines)
+
+
+class Tracer:
+    # a frame longer than this (ms) dumps the trace buffer
+    long_frame: float = 100
+    # seconds between two automatic dumps
+    dump_interval: float = 10
+
+    def __init__(self, size: int = 100000):
+        # set ZULU_DOODMAAK_TRACE to record from startup, asset loads included
+        self.enabled = bool(os.environ.get('ZULU_DOODMAAK_TRACE'))
+        self.events = deque(maxlen=size)
+        self.pid = os.getpid()
+        self.last_dump = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    @staticmethod
+    def timestamp(seconds: float) -> float:
+        return seconds * 1000000
+
+    def complete(self, name: str, started: float, ended: float, args: dict = None):
+        event = {'name': name, 'ph': 'X', 'ts': self.timestamp(started), 'dur': self.timestamp(ended - started),
+                 'pid': self.pid, 'tid': 0}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def instant(self, name: str, args: dict = None):
+        if not self.enabled:
+            return
+        event = {'name': name, 'ph': 'i', 's': 't', 'ts': self.timestamp(time.perf_counter()),
+                 'pid': self.pid, 'tid': 0}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def end_frame(self, started: float, ended: float):
+        self.complete('frame', started, ended)
+        if (ended - started) * 1000 >= self.long_frame and (
+                self.last_dump is None or ended - self.last_dump >= self.dump_interval):
+            self.last_dump = ended
+            self.dump()
+
+    def dump(self, path: str = None) -> str:
+        if path is None:
+            path = time.strftime('trace-%Y%m%d-%H%M%S.json')
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}, file)
+        return path
+
+
 class Drawing(Object):
     alpha: int = 255
+    z_index: int = 1
 
-    def __init__(self, game: 'Game', left=0, top=0, z_index: int = 1):
+    def __init__(self, game: 'Game', left=0, top=0, z_index: int = None):
         super().__init__(game)
-        self.z_index: int = z_index
+        if z_index is not None:
+            self.z_index = z_index
         self.surface: Surface or None = None
         self.rect: Rect = Rect(left, top, 0, 0)
 
@@ -159,6 +883,15 @@ class Drawing(Object):
         return x, y
 
     def draw(self):
+        profiler = self.game.profiler
+        if profiler.enabled:
+            started = time.perf_counter()
+            self.render()
+            profiler.add(type(self).__name__, 'draw', time.perf_counter() - started)
+        else:
+            self.render()
+
+    def render(self):
         self.surface.set_alpha(self.alpha)
         self.game.camera.blit(self)
 
@@ -181,7 +914,7 @@ class Sprite(Drawing):
             self.rect.size = self.surface.get_bounding_rect().size
         super()._process(delta)
 
-    def draw(self):
+    def render(self):
         if not self.animation:
             return
         if self.ss_size is None:
@@ -189,7 +922,9 @@ class Sprite(Drawing):
         else:
             self.surface = pygame.transform.scale(
                 self.animation.image(), self.ss_size)
-        super().draw()
+        if self.game.surface_tracker is not None:
+            self.game.surface_tracker.add(self.surface, 'Sprite.draw')
+        super().render()
 
 
 class UI:
@@ -208,7 +943,7 @@ class Camera(Object, Rect):
         self.max_size = 500
         self.viewport: Surface = Surface((self.base_w, self.base_h))
         self.ui = Surface((self.base_w, self.base_h), flags=pygame.SRCALPHA)
-        self.layers: Dict[Surface] = {}
+        self.layers: Dict[int, list] = {}
         self.min_x = min_x
         self.max_x = max_x
         self.min_y = min_y
@@ -219,29 +954,35 @@ class Camera(Object, Rect):
 
     def fill(self, color: pygame.Color):
         self.viewport = Surface(self.size)
+        if self.game.surface_tracker is not None:
+            self.game.surface_tracker.add(self.viewport, 'Camera')
         self.ui.fill((0, 0, 0, 0))
         self.viewport.fill(color)
 
     def blit(self, sprite: Drawing):
-        # if sprite.z_index not in self.layers:
-        #     self.layers[sprite.z_index] = Surface(self.size)
         rect = sprite.surface.get_rect()
         rect.center = sprite.rect.center
-        x, y = 0, 0
         if isinstance(sprite, UI):
-            x, y = rect.topleft
-            self.ui.blit(sprite.surface, (x, y))
+            self.ui.blit(sprite.surface, rect.topleft)
         else:
-            x = rect.x - self.x
-            y = rect.y - self.y
-            # self.layers[sprite.z_index].blit(sprite.surface, (x, y))
-            self.viewport.blit(sprite.surface, (x, y))
+            # world sprites are batched per z_index, so creation order does not decide what is on top
+            layer = self.layers.get(sprite.z_index)
+            if layer is None:
+                layer = self.layers[sprite.z_index] = []
+            layer.append((sprite.surface, (rect.x - self.x, rect.y - self.y)))
 
     def get_viewport(self):
-        # size = [i * self.scale for i in self.viewport.get_size()]
-        # for i in reversed(tuple(self.layers.values())):
-        #     self.viewport.blit(i, (0, 0))
+        tracer = self.game.tracer
+        for z_index in sorted(self.layers):
+            started = time.perf_counter()
+            self.viewport.blits(self.layers[z_index], False)
+            if tracer.enabled:
+                tracer.complete(f'blits z{z_index}', started, time.perf_counter(),
+                                {'surfaces': len(self.layers[z_index])})
+        self.layers = {}
         surf = pygame.transform.scale(self.viewport, self.game.window_size)
+        if self.game.surface_tracker is not None:
+            self.game.surface_tracker.add(surf, 'Camera')
         surf.blit(self.ui, (0, 0))
         return surf
 
@@ -281,51 +1022,300 @@ class Camera(Object, Rect):
 
 
 class Game(AbstractObject):
-    game_objects: List[AbstractObject] = []
-
-    def __init__(self, window_size, viewport_size, title="", icon="", full_screen: bool = True, tick_rate=60):
+    game_objects: List[AbstractObject]
+    voices: int = 16
+    # how far a sleeping drawing may reach out of the cell of its center
+    sleeper_margin: int = 128
+    # set by diagnostics.LeakTracker, gets every per-frame Surface with its origin
+    surface_tracker = None
+
+    def __init__(self, window_size, viewport_size, title="", icon="", full_screen: bool = True, tick_rate=60,
+                 seed: int = None):
+        # every random decision of the simulation goes through self.random, so a seed and the recorded
+        # input reproduce a match tick for tick
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.random = random.Random(self.seed)
+        self.tick = 0
+        self.recorder: replay.Recorder or None = None
+        self.playback: replay.Player or None = None
+        self.game_objects = []
+        self.dead_objects: List[AbstractObject] = []
+        # the objects the update loop runs, in creation order
+        self.active_objects: List[AbstractObject] = []
+        # sleeping drawings, drawn by visibility instead of by their process
+        self.sleepers: SpatialHash = SpatialHash()
+        self.woken: List[AbstractObject] = []
+        self.activity_changed = False
+        self.sequence = 0
+        self.profiler: Profiler = Profiler()
+        self.tracer: Tracer = Tracer()
+        self.bus: EventBus = EventBus(self.profiler)
+        self.latency: LatencyMonitor = LatencyMonitor()
+        self.scheduler: Scheduler = Scheduler()
+        self.ai: TaskScheduler = TaskScheduler(self.scheduler)
+        self.collisions: CollisionWorld = CollisionWorld()
+        # milliseconds of work per frame, without the time spent waiting for the clock
+        self.frame_times = deque(maxlen=240)
+        # the camera's image of the current frame, between rendering and flipping it
+        self.frame_image: Surface or None = None
+        self.running = False
         self.window_size = window_size
         flags = pygame.FULLSCREEN if full_screen else 0
         self.screen = pygame.display.set_mode(window_size, flags)
         pygame.display.set_caption(title)
         pygame.init()
         self.camera = Camera(self, viewport_size)
-        self.game_objects.append(self)
-        self.resources: Resources = Resources()
+        self.create_object(self)
+        self.mixer: Mixer = Mixer(self.voices, self.camera)
+        self.resources: Resources = Resources(mixer=self.mixer, tracer=self.tracer)
         self.mouse_coord = ()
         self.keys = ()
         self.tick_rate = tick_rate
+        self.bus.subscribe(pygame.KEYDOWN, self.debug_key)
         self.load_resources()
         pygame.display.set_icon(self.resources.animations[icon].images[0])
 
     def create_object(self, obj: AbstractObject):
+        obj.seq = self.sequence
+        self.sequence += 1
         self.game_objects.append(obj)
+        self.active_objects.append(obj)
+        for event_type in obj.events:
+            self.bus.subscribe(event_type, obj.event)
+
+    def remove_object(self, obj: AbstractObject):
+        if not obj.alive:
+            return
+        obj.alive = False
+        for event_type in obj.events:
+            self.bus.unsubscribe(event_type, obj.event)
+        self.sleepers.remove(obj)
+        self.dead_objects.append(obj)
+
+    def remove_dead_objects(self):
+        if self.dead_objects:
+            self.dead_objects = []
+            self.game_objects[:] = [el for el in self.game_objects if el.alive]
+            self.active_objects[:] = [el for el in self.active_objects if el.alive]
+
+    def sleep(self, obj: AbstractObject, visible: bool = True):
+        # visible drawings keep being drawn while they are on screen, the others are drawn by their owner
+        if obj.asleep or not obj.alive:
+            return
+        obj.asleep = True
+        if visible and isinstance(obj, Drawing):
+            self.sleepers.insert(obj, obj.rect.center)
+        self.activity_changed = True
+
+    def wake(self, obj: AbstractObject):
+        if not obj.asleep:
+            return
+        obj.asleep = False
+        self.sleepers.remove(obj)
+        self.woken.append(obj)
+        self.activity_changed = True
+
+    def update_active_objects(self):
+        # runs after the update loop, so waking or sleeping takes effect from the next frame on
+        if not self.activity_changed:
+            return
+        self.activity_changed = False
+        active = [el for el in self.active_objects if not el.asleep]
+        if self.woken:
+            present = set(map(id, active))
+            woken = {id(el): el for el in self.woken if el.alive and not el.asleep and id(el) not in present}
+            self.woken = []
+            if woken:
+                active = list(heapq.merge(active, sorted(woken.values(), key=creation_order), key=creation_order))
+        self.active_objects = active
+
+    def draw_sleepers(self):
+        camera = self.camera
+        visible = [el for el in self.sleepers.query(camera, self.sleeper_margin) if el.rect.colliderect(camera)]
+        visible.sort(key=creation_order)
+        for el in visible:
+            el.draw()
 
     def load_resources(self):
         pass
 
-    def start(self, fill=None):
-        running = True
+    def debug_key(self, event):
+        if event.key == PROFILER_KEY:
+            if self.profiler.enabled:
+                print(self.profiler.report())
+            self.profiler.toggle()
+        elif event.key == TRACE_KEY:
+            # the first press starts recording, the next ones dump the buffer
+            if self.tracer.enabled:
+                print('trace written to', self.tracer.dump())
+            else:
+                self.tracer.enable()
+        elif event.key == PAUSE_KEY:
+            self.scheduler.toggle_pause()
+
+    def record(self, path: str, level: str):
+        # a wall time budget would make the recorded run and the replay think on different frames
+        self.ai.budget = None
+        self.recorder = replay.Recorder(replay.Replay(self.seed, level, self.window_size,
+                                                     (self.camera.base_w, self.camera.base_h)), path)
+
+    def play(self, recording: replay.Replay):
+        self.ai.budget = None
+        self.playback = replay.Player(recording)
+
+    def start(self, fill=None, realtime: bool = True):
+        self.running = True
         clock: pygame.time.Clock = pygame.time.Clock()
-        while running:
-            self.mouse_coord = pygame.mouse.get_pos()
-            self.keys = pygame.key.get_pressed()
-            tick = clock.tick(self.tick_rate)
-            if fill is not None:
-                self.camera.fill(fill)
-                self.screen.fill(fill)
-            for el in self.game_objects:
-                el._process(tick)
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                else:
-                    for el in self.game_objects:
-                        el.event(event)
-            self.screen.blit(self.camera.get_viewport(), (0, 0))
-            pygame.display.flip()
+        while self.running:
+            # a replay without realtime runs as fast as it can, its deltas come from the recording anyway
+            tick = clock.tick(self.tick_rate if realtime else 0)
+            self.frame(tick, fill)
+        if self.recorder is not None:
+            self.recorder.save()
+        if self.latency.samples:
+            print(self.latency.report())
         self.quit()
 
+    def frame(self, delta: float, fill=None):
+        if self.playback is not None:
+            if self.playback.finished(self.tick):
+                self.running = False
+                return
+            delta = self.playback.delta(self.tick)
+        started = time.perf_counter()
+        if self.profiler.enabled or self.tracer.enabled:
+            self.instrumented_frame(delta, fill)
+        else:
+            self.run_frame(delta, fill)
+        ended = time.perf_counter()
+        self.frame_times.append((ended - started) * 1000)
+        if self.tracer.enabled:
+            self.tracer.end_frame(started, ended)
+        if self.recorder is not None:
+            self.recorder.end_tick(delta, self.mouse_coord, self.keys)
+        self.tick += 1
+
+    def run_frame(self, delta: float, fill=None):
+        for _, step, _ in self._phases(fill):
+            delta = step(delta)
+
+    def instrumented_frame(self, delta: float, fill=None):
+        started = time.perf_counter()
+        for name, step, args in self._phases(fill):
+            delta = step(delta)
+            started = self.phase(name, started, args() if args is not None and self.tracer.enabled else None)
+        if self.profiler.enabled:
+            self.profiler.end_frame()
+
+    def _phases(self, fill) -> Tuple[Tuple[str, Callable[[float], float], Callable or None], ...]:
+        """The steps of a frame in order, as (name, step, trace args).
+
+        A step takes the frame's delta and returns the delta for the steps after it. Input is applied before
+        simulation so its effect lands in this frame's image.
+        """
+        return (
+            ('events', self._pump_events, None),
+            ('timers', self.scheduler.advance, None),
+            ('ai', self._run_ai, None),
+            ('collisions', self._step_collisions, lambda: {'contacts': self.collisions.contacts}),
+            ('sleepers', lambda delta: self._draw_background(delta, fill), lambda: {'objects': len(self.sleepers)}),
+            ('process', self._process_objects, None),
+            ('viewport', self._render_viewport, None),
+            ('flip', self._flip, None),
+        )
+
+    def phase(self, name: str, started: float, args: dict = None) -> float:
+        ended = time.perf_counter()
+        if self.profiler.enabled:
+            self.profiler.phase(name, ended - started)
+        if self.tracer.enabled:
+            self.tracer.complete(name, started, ended, args)
+        return ended
+
+    def _pump_events(self, delta: float) -> float:
+        self.pump_events()
+        return delta
+
+    def _run_ai(self, delta: float) -> float:
+        self.ai.run()
+        return delta
+
+    def _step_collisions(self, delta: float) -> float:
+        self.collisions.step(delta)
+        return delta
+
+    def _draw_background(self, delta: float, fill) -> float:
+        if fill is not None:
+            self.camera.fill(fill)
+            self.screen.fill(fill)
+        self.draw_sleepers()
+        return delta
+
+    def _process_objects(self, delta: float) -> float:
+        profiler = self.profiler if self.profiler.enabled else None
+        tracer = self.tracer if self.tracer.enabled else None
+        if profiler is None and tracer is None:
+            for el in self.active_objects:
+                el._process(delta)
+        else:
+            clock = time.perf_counter
+            # the trace gets one span per run of consecutive objects of the same class
+            run_class, run_started, run_length = None, 0, 0
+            for el in self.active_objects:
+                el_started = clock()
+                el._process(delta)
+                el_class = type(el)
+                if profiler is not None:
+                    profiler.add(el_class.__name__, 'process', clock() - el_started)
+                if tracer is not None:
+                    if el_class is not run_class:
+                        if run_class is not None:
+                            tracer.complete(run_class.__name__, run_started, el_started, {'objects': run_length})
+                        run_class, run_started, run_length = el_class, el_started, 0
+                    run_length += 1
+            if tracer is not None and run_class is not None:
+                tracer.complete(run_class.__name__, run_started, clock(), {'objects': run_length})
+        self.remove_dead_objects()
+        self.update_active_objects()
+        self.mixer.flush()
+        return delta
+
+    def _render_viewport(self, delta: float) -> float:
+        self.frame_image = self.camera.get_viewport()
+        return delta
+
+    def _flip(self, delta: float) -> float:
+        self.screen.blit(self.frame_image, (0, 0))
+        self.frame_image = None
+        pygame.display.flip()
+        self.latency.present()
+        return delta
+
+    def pump_events(self):
+        # the state is sampled before dispatching, so handlers see the same mouse and keys on replay
+        events = pygame.event.get()
+        self.latency.poll()
+        if self.playback is not None:
+            # the real input is replaced by the recorded one, QUIT and the timer events still come through
+            events = [event for event in events if event.type not in INPUT_EVENTS] + self.playback.events(self.tick)
+            self.mouse_coord = self.playback.mouse
+            self.keys = self.playback.keys
+        else:
+            self.mouse_coord, self.keys = self.read_input()
+        for event in events:
+            self.latency.input(event)
+            if event.type == pygame.QUIT:
+                self.running = False
+            else:
+                if self.recorder is not None and event.type in INPUT_EVENTS:
+                    self.recorder.add_event(event)
+                self.bus.post(event)
+        self.bus.flush()
+
+    @staticmethod
+    def read_input():
+        return pygame.mouse.get_pos(), pygame.key.get_pressed()
+
     @staticmethod
     def quit():
         pygame.quit()
@@ -343,6 +1333,8 @@ class Text(Drawing, UI):
         if self.surface:
             self.surface.fill((0, 0, 0, 0))
         self.surface = self.font.render(str(text), 1, self.color)
+        if self.game.surface_tracker is not None:
+            self.game.surface_tracker.add(self.surface, 'Text')
         self.rect.size = self.surface.get_size()
 
     def _process(self, delta: float) -> None:
@@ -353,11 +1345,18 @@ class Text(Drawing, UI):
 class Resources:
     animations: Dict[str, Animation] = {}
     sounds: Dict[str, Sound] = {}
+    music: Dict[str, str] = {}
     fonts: Dict[str, pygame.font.Font] = {}
     base_path: str
 
-    def __init__(self, base_path='data'):
+    def __init__(self, base_path='data', mixer: Mixer = None, tracer: Tracer = None):
         self.base_path = base_path
+        self.mixer = mixer
+        self.tracer = tracer
+
+    def trace_load(self, kind: str, name: str):
+        if self.tracer is not None:
+            self.tracer.instant('load', {'kind': kind, 'name': name})
 
     def load_animations(self, animations):
         if type(animations) == dict:
@@ -366,22 +1365,31 @@ class Resources:
             self.load_animation(*i)
 
     def load_animation(self, animation_name, filenames):
+        self.trace_load('animation', animation_name)
         self.animations[animation_name] = Animation(
             list(map(self.load_image, filenames)))
 
     def load_font(self, font_name, filename, size=24):
+        self.trace_load('font', font_name)
         fullname = os.path.join(self.base_path, filename)
         self.fonts[font_name] = pygame.font.Font(fullname, size)
 
     def load_sounds(self, sounds):
         if type(sounds) == dict:
             sounds = sounds.items()
-        for i in sounds:
-            self.load_sound(*i)
+        for sound_name, args in sounds:
+            if isinstance(args, str):
+                args = (args,)
+            self.load_sound(sound_name, *args)
 
-    def load_sound(self, sound_name, filename):
+    def load_sound(self, sound_name, filename, group=None, priority=0):
+        self.trace_load('sound', sound_name)
         path = os.path.join(self.base_path, filename)
-        self.sounds[sound_name] = Sound(pygame.mixer.Sound(path))
+        self.sounds[sound_name] = Sound(pygame.mixer.Sound(path), self.mixer, group, priority)
+
+    def load_music(self, music_name, filename):
+        # only the path is kept, Music streams the file when it is played
+        self.music[music_name] = os.path.join(self.base_path, filename)
 
     def load_image(self, name, color_key=None):
         fullname = os.path.join(self.base_path, name)
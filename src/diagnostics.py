@@ -0,0 +1,223 @@
+import gc
+import tracemalloc
+import weakref
+from collections import Counter, deque
+from typing import Callable, Dict, List, Tuple
+
+import pygame
+
+from src import core
+
+OVERLAY_KEY = pygame.K_F3
+
+
+class PerformanceOverlay(core.Drawing, core.UI):
+    events = (pygame.KEYDOWN,)
+    z_index = 90
+    color = (255, 255, 255)
+    background = (0, 0, 0, 170)
+    graph_size = (240, 60)
+    # budget line of the frame time graph, in ms
+    frame_budget = 1000 / 60
+
+    def __init__(self, game: core.Game, font_name: str, interval: int = 250, top: int = 8):
+        super().__init__(game)
+        self.font: pygame.font.Font = self.game.resources.fonts[font_name]
+        self.interval = interval
+        self.top = top
+        self.visible = False
+        self.owns_profiler = False
+        self.left_for_redraw = 0
+        self.deltas: List[float] = []
+        self.counters: Dict[str, Callable] = {}
+        self.caches: Dict[str, Callable] = {}
+
+    def add_counter(self, name: str, counter: Callable):
+        self.counters[name] = counter
+
+    def add_cache(self, name: str, stats: Callable):
+        # stats returns (hits, misses)
+        self.caches[name] = stats
+
+    def toggle(self):
+        self.visible = not self.visible
+        profiler = self.game.profiler
+        if self.visible and not profiler.enabled:
+            profiler.enable()
+            self.owns_profiler = True
+        elif not self.visible and self.owns_profiler:
+            profiler.disable()
+            self.owns_profiler = False
+        self.left_for_redraw = 0
+
+    def event(self, event) -> None:
+        if event.key == OVERLAY_KEY:
+            self.toggle()
+
+    def process(self, delta: float) -> None:
+        if not self.visible:
+            return
+        self.deltas.append(delta)
+        self.left_for_redraw -= delta
+        if self.left_for_redraw <= 0:
+            self.left_for_redraw = self.interval
+            self.redraw()
+        self.draw()
+
+    def lines(self) -> List[str]:
+        game = self.game
+        fps = 1000 * len(self.deltas) / sum(self.deltas) if sum(self.deltas) else 0
+        self.deltas = []
+        frame_times = game.frame_times
+        lines = [f'{fps:.0f} fps  frame {core.percentile(frame_times, 50):.1f} ms, '
+                 f'p99 {core.percentile(frame_times, 99):.1f} ms']
+
+        stats = game.profiler.summary or game.profiler.stats()
+        phases = stats['phases']
+        draw = sum(i['draw']['ms'] for i in stats['classes'].values() if 'draw' in i)
+        simulation = sum(phases.get(name, 0) for name in ('timers', 'ai', 'collisions', 'sleepers', 'process')) - draw
+        render = draw + phases.get('viewport', 0) + phases.get('flip', 0)
+        lines.append(f'sim {simulation:.1f} ms  render {render:.1f} ms  events {phases.get("events", 0):.1f} ms')
+
+        latency = game.latency.percentiles()
+        lines.append(f'input latency p50 {latency[50]:.1f} ms  p99 {latency[99]:.1f} ms')
+        lines.append(f'mixer {len(game.mixer.busy_voices())}/{game.mixer.voices} voices')
+        lines.extend(f'{name} {counter()}' for name, counter in self.counters.items())
+        for name, cache in self.caches.items():
+            hits, misses = cache()
+            rate = hits / (hits + misses) * 100 if hits + misses else 0
+            lines.append(f'{name} cache {rate:.0f}% of {hits + misses}')
+
+        classes = Counter(type(i).__name__ for i in game.game_objects)
+        lines.append(f'objects {len(game.game_objects)}  active {len(game.active_objects)}')
+        lines.extend(f'  {name} {count}' for name, count in classes.most_common(8))
+        return lines
+
+    def graph(self) -> pygame.Surface:
+        width, height = self.graph_size
+        surface = pygame.Surface(self.graph_size, pygame.SRCALPHA)
+        scale = height / (self.frame_budget * 2)
+        budget_y = height - self.frame_budget * scale
+        pygame.draw.line(surface, (255, 255, 0), (0, budget_y), (width, budget_y))
+        times = list(self.game.frame_times)[-width:]
+        points = [(x, max(0, height - t * scale)) for x, t in enumerate(times)]
+        if len(points) > 1:
+            pygame.draw.lines(surface, (0, 255, 0), False, points)
+        return surface
+
+    def redraw(self):
+        texts = [self.font.render(line, True, self.color) for line in self.lines()]
+        graph = self.graph()
+        width = max([graph.get_width()] + [i.get_width() for i in texts]) + 16
+        height = sum(i.get_height() for i in texts) + graph.get_height() + 24
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.surface.fill(self.background)
+        y = 8
+        for text in texts:
+            self.surface.blit(text, (8, y))
+            y += text.get_height()
+        self.surface.blit(graph, (8, y + 8))
+        self.rect.size = self.surface.get_size()
+        self.rect.topright = self.game.camera.base_w - 8, self.top
+
+
+class SurfaceTracker:
+
+    def __init__(self):
+        self.live: Dict[str, weakref.WeakSet] = {}
+        self.created = Counter()
+
+    def add(self, surface: pygame.Surface, origin: str):
+        live = self.live.get(origin)
+        if live is None:
+            live = self.live[origin] = weakref.WeakSet()
+        live.add(surface)
+        self.created[origin] += 1
+
+    def stats(self) -> Dict[str, Tuple[int, int]]:
+        # origin -> (live surfaces, bytes of their pixels)
+        return {origin: (len(live), sum(i.get_pitch() * i.get_height() for i in live))
+                for origin, live in self.live.items()}
+
+
+class LeakTracker(core.Object):
+    # a count has to grow over this many samples in a row to be reported
+    growth_samples: int = 4
+    top_allocations: int = 5
+
+    def __init__(self, game: core.Game, interval: int = 600, history: int = 32, report=print):
+        super().__init__(game)
+        self.interval = interval
+        self.report = report
+        self.ticks = 0
+        self.history = deque(maxlen=history)
+        self.checks: Dict[str, Callable] = {}
+        self.warnings: List[str] = []
+        self.surfaces = self.game.surface_tracker = SurfaceTracker()
+        self.created = Counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+
+    def add_check(self, name: str, check: Callable):
+        # a check returns a count that should stay at zero
+        self.checks[name] = check
+
+    def process(self, delta: float) -> None:
+        self.ticks += 1
+        if self.ticks % self.interval == 0:
+            self.sample()
+
+    def sample(self) -> dict:
+        gc.collect()
+        instances = Counter(type(i).__name__ for i in gc.get_objects() if isinstance(i, core.AbstractObject))
+        registered = Counter(type(i).__name__ for i in self.game.game_objects)
+        surfaces = self.surfaces.stats()
+        created = self.surfaces.created - self.created
+        self.created = self.surfaces.created.copy()
+
+        snapshot = tracemalloc.take_snapshot()
+        allocations = snapshot.compare_to(self.snapshot, 'lineno')[:self.top_allocations]
+        self.snapshot = snapshot
+
+        sample = {
+            'tick': self.ticks,
+            'instances': dict(instances),
+            'registered': dict(registered),
+            'surfaces': surfaces,
+            'surfaces_per_tick': {origin: count / self.interval for origin, count in created.items()},
+            'allocations': [str(i) for i in allocations],
+            'checks': {name: check() for name, check in self.checks.items()},
+        }
+        self.history.append(sample)
+        self.warnings = self.find_leaks(sample)
+        if self.warnings and self.report is not None:
+            self.report('\n'.join([f'leak check at tick {self.ticks}:'] + [f'  {i}' for i in self.warnings]))
+        return sample
+
+    def growing(self, key: str) -> List[str]:
+        samples = list(self.history)[-self.growth_samples - 1:]
+        if len(samples) <= self.growth_samples:
+            return []
+        names = set.intersection(*(set(i[key]) for i in samples))
+        counts = {name: [self.count(i[key][name]) for i in samples] for name in names}
+        return sorted(name for name, values in counts.items()
+                      if all(a < b for a, b in zip(values, values[1:])))
+
+    @staticmethod
+    def count(value) -> int:
+        return value[0] if isinstance(value, tuple) else value
+
+    def find_leaks(self, sample: dict) -> List[str]:
+        warnings = [f'{name} instances keep growing ({sample["instances"][name]})'
+                    for name in self.growing('instances')]
+        warnings.extend(f'{origin} surfaces keep growing ({sample["surfaces"][origin][0]})'
+                        for origin in self.growing('surfaces'))
+        for name, count in sample['instances'].items():
+            registered = sample['registered'].get(name, 0)
+            if count > registered:
+                warnings.append(f'{count - registered} {name} still referenced after kill()')
+        warnings.extend(f'{origin} creates {rate:.1f} surfaces per tick'
+                        for origin, rate in sample['surfaces_per_tick'].items() if rate >= 1)
+        warnings.extend(f'{name}: {count}' for name, count in sample['checks'].items() if count)
+        return warnings
@@ -0,0 +1,68 @@
+import math
+from typing import Callable, Dict, List, Sequence, Tuple
+
+Point = Tuple[float, float]
+
+
+def line(count: int) -> List[int]:
+    return [count]
+
+
+def box(count: int) -> List[int]:
+    cols = math.ceil(math.sqrt(count))
+    rows = [cols] * (count // cols)
+    if count % cols:
+        rows.append(count % cols)
+    return rows
+
+
+def wedge(count: int) -> List[int]:
+    rows = []
+    size = 1
+    while count > 0:
+        rows.append(min(size, count))
+        count -= size
+        size += 1
+    return rows
+
+
+# the number of slots of every row, front row first
+SHAPES: Dict[str, Callable[[int], List[int]]] = {
+    'box': box,
+    'line': line,
+    'wedge': wedge,
+}
+
+
+def arrange(points: Sequence[Point], goal: Point, shape: str, spacing: float) -> List[Point]:
+    """The slot around goal for every point, in the order of points.
+
+    The formation faces from the group's center towards goal. Slots are matched to the units by sorting instead of an
+    optimal assignment: the units furthest ahead take the front row, and within a row they keep their order from
+    left to right, so paths hardly ever cross.
+    """
+    count = len(points)
+    if not count:
+        return []
+    cx = sum(x for x, _ in points) / count
+    cy = sum(y for _, y in points) / count
+    fx, fy = goal[0] - cx, goal[1] - cy
+    length = math.hypot(fx, fy)
+    fx, fy = (fx / length, fy / length) if length else (0, -1)
+    # the right hand side of the formation's facing, y grows downwards
+    rx, ry = -fy, fx
+
+    rows = SHAPES[shape](count)
+    forward = [(x - cx) * fx + (y - cy) * fy for x, y in points]
+    right = [(x - cx) * rx + (y - cy) * ry for x, y in points]
+    ahead = sorted(range(count), key=lambda i: (-forward[i], i))
+    slots: List[Point] = [goal] * count
+    start = 0
+    for row, size in enumerate(rows):
+        depth = ((len(rows) - 1) / 2 - row) * spacing
+        units = sorted(ahead[start:start + size], key=lambda i: (right[i], i))
+        for column, i in enumerate(units):
+            lateral = (column - (size - 1) / 2) * spacing
+            slots[i] = goal[0] + fx * depth + rx * lateral, goal[1] + fy * depth + ry * lateral
+        start += size
+    return slots
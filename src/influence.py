@@ -0,0 +1,125 @@
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from src import core
+
+
+def spread(grid: np.ndarray, radius: int) -> np.ndarray:
+    """Blurs every layer of grid with a separable triangle kernel, a cell keeps its full value at the center."""
+    if radius <= 0:
+        return grid.copy()
+    weights = [(radius + 1 - abs(i)) / (radius + 1) for i in range(-radius, radius + 1)]
+    result = grid
+    for axis in (-2, -1):
+        size = result.shape[axis]
+        padding = [(0, 0)] * result.ndim
+        padding[axis] = (radius, radius)
+        padded = np.pad(result, padding)
+        blurred = np.zeros_like(result)
+        for offset, weight in enumerate(weights):
+            blurred += weight * padded.take(range(offset, offset + size), axis=axis)
+        result = blurred
+    return result
+
+
+class InfluenceMap:
+    """Strength of every player and value of the free resources on a coarse grid.
+
+    Rebuilt a few times per second on the AI scheduler, AI decisions sample it in constant time. The units of every
+    cell are kept too, so a target search only looks at the cells around the searching unit.
+    """
+
+    def __init__(self, game: core.Game, width: int, height: int, players: List, strength: Callable,
+                 resources: Callable, cell_size: int = 128, radius: int = 2, interval: int = 250):
+        self.game = game
+        self.cell_size = cell_size
+        self.cols = max(1, (width + cell_size - 1) // cell_size)
+        self.rows = max(1, (height + cell_size - 1) // cell_size)
+        self.players = players
+        self.player_index = {id(player): i for i, player in enumerate(players)}
+        # strength(unit) and resources() -> [(point, value)] are supplied by the game
+        self.strength = strength
+        self.resources = resources
+        self.radius = radius
+        self.influence = np.zeros((len(players), self.rows, self.cols), np.float32)
+        self.total = np.zeros((self.rows, self.cols), np.float32)
+        self.value = np.zeros((self.rows, self.cols), np.float32)
+        self.units: Dict[Tuple[int, int], list] = {}
+        # the cell every unit was put in by the last update, by id of the unit
+        self.unit_cells: Dict[int, Tuple[int, int]] = {}
+        self.updates = 0
+        self.task = game.ai.add(self.update, interval)
+
+    def cell(self, point) -> Tuple[int, int]:
+        col = min(max(0, int(point[0]) // self.cell_size), self.cols - 1)
+        row = min(max(0, int(point[1]) // self.cell_size), self.rows - 1)
+        return col, row
+
+    def update(self):
+        strength = np.zeros_like(self.influence)
+        units: Dict[Tuple[int, int], list] = {}
+        unit_cells: Dict[int, Tuple[int, int]] = {}
+        for i, player in enumerate(self.players):
+            cells, values = [], []
+            for unit in player.units:
+                if unit.hp <= 0:
+                    continue
+                cell = self.cell(unit.rect.center)
+                units.setdefault(cell, []).append(unit)
+                unit_cells[id(unit)] = cell
+                cells.append(cell)
+                values.append(self.strength(unit))
+            if cells:
+                cols, rows = np.array(cells).T
+                np.add.at(strength[i], (rows, cols), values)
+        self.influence = spread(strength, self.radius)
+        self.total = self.influence.sum(axis=0)
+        self.units = units
+        self.unit_cells = unit_cells
+
+        value = np.zeros_like(self.value)
+        resources = self.resources()
+        if resources:
+            cells = np.array([self.cell(point) for point, _ in resources])
+            np.add.at(value, (cells[:, 1], cells[:, 0]), [amount for _, amount in resources])
+        self.value = spread(value, self.radius)
+        self.updates += 1
+
+    def remove(self, unit):
+        """Forgets a unit that left the game before the next update."""
+        cell = self.unit_cells.pop(id(unit), None)
+        if cell is not None:
+            self.units[cell].remove(unit)
+
+    def friendly(self, player, point) -> float:
+        col, row = self.cell(point)
+        return float(self.influence[self.player_index[id(player)], row, col])
+
+    def enemy(self, player, point) -> float:
+        col, row = self.cell(point)
+        return float(self.total[row, col] - self.influence[self.player_index[id(player)], row, col])
+
+    def resource_value(self, point) -> float:
+        col, row = self.cell(point)
+        return float(self.value[row, col])
+
+    def richest_cell(self, point, cells: int) -> Tuple[float, float] or None:
+        """The center of the most valuable cell at most cells away from point, None when there is nothing."""
+        col, row = self.cell(point)
+        left, top = max(0, col - cells), max(0, row - cells)
+        window = self.value[top:row + cells + 1, left:col + cells + 1]
+        if not window.size or window.max() <= 0:
+            return None
+        y, x = np.unravel_index(int(window.argmax()), window.shape)
+        return (left + x + 0.5) * self.cell_size, (top + y + 0.5) * self.cell_size
+
+    def enemies_near(self, player, point) -> Iterator:
+        """Living units of the other players in the cell of point and the cells around it, as of the last update."""
+        col, row = self.cell(point)
+        units = self.units
+        for x in range(col - 1, col + 2):
+            for y in range(row - 1, row + 2):
+                for unit in units.get((x, y), ()):
+                    if unit.player is not player and unit.hp > 0:
+                        yield unit
@@ -0,0 +1,142 @@
+import json
+import struct
+import sys
+from array import array
+from typing import Dict, Iterator, Tuple
+
+MAGIC = b'ZDLV'
+VERSION = 1
+KINDS = ('collected', 'constructions', 'units')
+# magic, version, width, height, base zoom, camera x, camera y, one entity count per kind
+HEADER = struct.Struct('<4sHiidii' + 'I' * len(KINDS))
+# every entity is stored as (type, x, y, player), collected entities have no player
+RECORD_SIZE = 4
+NO_PLAYER = -1
+
+
+def records(data: array) -> Iterator[Tuple[int, int, int, int]]:
+    return zip(data[0::RECORD_SIZE], data[1::RECORD_SIZE], data[2::RECORD_SIZE], data[3::RECORD_SIZE])
+
+
+class LevelData:
+
+    def __init__(self, width: int, height: int, base_zoom: float = 1, camera_pos=(0, 0)):
+        self.width = width
+        self.height = height
+        self.base_zoom = base_zoom
+        self.camera_pos = tuple(camera_pos)
+        self.entities: Dict[str, array] = {kind: array('i') for kind in KINDS}
+
+    def add(self, kind: str, entity_type: int, x: int, y: int, player: int = NO_PLAYER):
+        self.entities[kind].extend((entity_type, x, y, player))
+
+    def count(self, kind: str) -> int:
+        return len(self.entities[kind]) // RECORD_SIZE
+
+    def records(self, kind: str) -> Iterator[Tuple[int, int, int, int]]:
+        return records(self.entities[kind])
+
+    def __eq__(self, other):
+        return isinstance(other, LevelData) and (
+            self.width, self.height, self.base_zoom, self.camera_pos, self.entities
+        ) == (
+            other.width, other.height, other.base_zoom, other.camera_pos, other.entities
+        )
+
+
+def from_json(text: str) -> LevelData:
+    data: dict = json.loads(text)
+    level = LevelData(data.get('width'), data.get('height'), data.get('base_zoom', 1), data.get('camera_pos', (0, 0)))
+    for kind in KINDS:
+        for entity in data.get(kind, ()):
+            pos = entity.get('pos')
+            level.add(kind, entity.get('type'), pos[0], pos[1], entity.get('player', NO_PLAYER))
+    return level
+
+
+def to_json(level: LevelData) -> str:
+    data = {
+        'width': level.width,
+        'height': level.height,
+        'base_zoom': level.base_zoom,
+        'camera_pos': list(level.camera_pos),
+    }
+    for kind in KINDS:
+        entities = []
+        for entity_type, x, y, player in level.records(kind):
+            entity = {'type': entity_type, 'pos': [x, y]}
+            if player != NO_PLAYER:
+                entity['player'] = player
+            entities.append(entity)
+        data[kind] = entities
+    return json.dumps(data, indent=2)
+
+
+def to_binary(level: LevelData) -> bytes:
+    header = HEADER.pack(MAGIC, VERSION, level.width, level.height, level.base_zoom, *level.camera_pos,
+                         *(level.count(kind) for kind in KINDS))
+    chunks = [header]
+    for kind in KINDS:
+        data = level.entities[kind]
+        if sys.byteorder == 'big':
+            data = array('i', data)
+            data.byteswap()
+        chunks.append(data.tobytes())
+    return b''.join(chunks)
+
+
+def from_binary(binary: bytes) -> LevelData:
+    if len(binary) < HEADER.size:
+        raise ValueError(f'truncated level header, {len(binary)} of {HEADER.size} bytes')
+    magic, version, width, height, base_zoom, camera_x, camera_y, *counts = HEADER.unpack_from(binary)
+    if magic != MAGIC:
+        raise ValueError('not a zulu-doodmaak level')
+    if version != VERSION:
+        raise ValueError(f'unsupported level version {version}')
+    expected = HEADER.size + sum(counts) * RECORD_SIZE * array('i').itemsize
+    if len(binary) != expected:
+        raise ValueError(f'level size {len(binary)} does not match the {expected} bytes of its header')
+    level = LevelData(width, height, base_zoom, (camera_x, camera_y))
+    offset = HEADER.size
+    for kind, count in zip(KINDS, counts):
+        data = level.entities[kind]
+        size = count * RECORD_SIZE * data.itemsize
+        data.frombytes(binary[offset:offset + size])
+        if sys.byteorder == 'big':
+            data.byteswap()
+        offset += size
+    return level
+
+
+def load(path: str) -> LevelData:
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as file:
+            return from_json(file.read())
+    with open(path, 'rb') as file:
+        return from_binary(file.read())
+
+
+def save(level: LevelData, path: str):
+    if path.endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(to_json(level))
+    else:
+        with open(path, 'wb') as file:
+            file.write(to_binary(level))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert levels between the JSON and the binary format')
+    parser.add_argument('source')
+    parser.add_argument('target')
+    parser.add_argument('--check', action='store_true', help='verify that the written level loads back unchanged')
+    args = parser.parse_args(argv)
+    level = load(args.source)
+    save(level, args.target)
+    if args.check and load(args.target) != level:
+        sys.exit(f'{args.target}: round trip mismatch')
+
+
+if __name__ == '__main__':
+    main()
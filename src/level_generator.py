@@ -0,0 +1,139 @@
+import math
+import random
+import sys
+from typing import Dict, List
+
+from src import level_format
+
+# the keys are the ones of COLLECTED_KEYS, CONSTRUCTION_KEYS and UNITS_KEYS
+KING = 4
+PRESETS = {
+    '1k': {
+        'width': 4096, 'height': 2560,
+        'collected': {0: 200, 1: 150, 2: 150, 3: 100, 4: 100},
+        'constructions': {0: 20},
+        'units': {0: 120, 1: 100, 2: 30, 3: 30},
+    },
+    '10k': {
+        'width': 12800, 'height': 8000,
+        'collected': {0: 2000, 1: 1500, 2: 1500, 3: 1000, 4: 1000},
+        'constructions': {0: 200},
+        'units': {0: 1200, 1: 1000, 2: 300, 3: 300},
+    },
+    '50k': {
+        'width': 28800, 'height': 18000,
+        'collected': {0: 10000, 1: 7500, 2: 7500, 3: 5000, 4: 5000},
+        'constructions': {0: 1000},
+        'units': {0: 6000, 1: 5000, 2: 1500, 3: 1500},
+    },
+}
+
+
+class LevelGenerator:
+    margin: int = 64
+
+    def __init__(self, width: int, height: int, seed: int = 0, players: int = 2, player_split: List[float] = None,
+                 clusters: int = 0, cluster_radius: float = 300, army_radius: float = 400):
+        self.width = width
+        self.height = height
+        self.random = random.Random(seed)
+        self.players = players
+        self.player_split = player_split or [1] * players
+        self.clusters = [self.random_point() for _ in range(clusters)]
+        self.cluster_radius = cluster_radius
+        self.army_radius = army_radius
+        self.bases = self.player_bases()
+
+    def random_point(self):
+        return (self.random.uniform(self.margin, self.width - self.margin),
+                self.random.uniform(self.margin, self.height - self.margin))
+
+    def player_bases(self):
+        # the players are spread on an ellipse around the centre of the map
+        rx = max(0, self.width / 2 - self.margin * 4)
+        ry = max(0, self.height / 2 - self.margin * 4)
+        bases = []
+        for i in range(self.players):
+            angle = math.pi + 2 * math.pi * i / self.players
+            bases.append((self.width / 2 + rx * math.cos(angle), self.height / 2 + ry * math.sin(angle)))
+        return bases
+
+    def clamp(self, x, y):
+        return (int(min(max(0, x), self.width - self.margin)),
+                int(min(max(0, y), self.height - self.margin)))
+
+    def around(self, center, radius):
+        return self.clamp(self.random.gauss(center[0], radius), self.random.gauss(center[1], radius))
+
+    def collected_point(self):
+        if self.clusters:
+            return self.around(self.random.choice(self.clusters), self.cluster_radius)
+        return self.clamp(*self.random_point())
+
+    def split(self, count: int) -> List[int]:
+        total = sum(self.player_split)
+        counts = [int(count * i / total) for i in self.player_split]
+        counts[0] += count - sum(counts)
+        return counts
+
+    def generate(self, collected: Dict[int, int], constructions: Dict[int, int], units: Dict[int, int],
+                 kings: bool = True, base_zoom: float = 1.3) -> level_format.LevelData:
+        level = level_format.LevelData(self.width, self.height, base_zoom,
+                                       self.clamp(self.bases[0][0] - 320, self.bases[0][1] - 200))
+        for type, count in sorted(collected.items()):
+            for _ in range(count):
+                level.add('collected', type, *self.collected_point())
+        for kind, entities in (('constructions', constructions), ('units', units)):
+            for type, count in sorted(entities.items()):
+                for player, player_count in enumerate(self.split(count)):
+                    for _ in range(player_count):
+                        level.add(kind, type, *self.around(self.bases[player], self.army_radius), player)
+        if kings:
+            for player, base in enumerate(self.bases):
+                level.add('units', KING, *self.clamp(*base), player)
+        return level
+
+
+def parse_counts(text: str) -> Dict[int, int]:
+    counts = {}
+    for item in filter(None, text.split(',')):
+        type, count = item.split('=')
+        counts[int(type)] = int(count)
+    return counts
+
+
+def generate_preset(name: str, seed: int = 0, players: int = 2, clusters: int = 0) -> level_format.LevelData:
+    preset = PRESETS[name]
+    generator = LevelGenerator(preset['width'], preset['height'], seed, players, clusters=clusters)
+    return generator.generate(preset['collected'], preset['constructions'], preset['units'])
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate a seeded stress level')
+    parser.add_argument('target', help='a .json file or a binary level')
+    parser.add_argument('--preset', choices=sorted(PRESETS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--width', type=int, default=4096)
+    parser.add_argument('--height', type=int, default=4096)
+    parser.add_argument('--collected', type=parse_counts, default={}, help='type=count,... of COLLECTED_KEYS')
+    parser.add_argument('--constructions', type=parse_counts, default={}, help='type=count,... of CONSTRUCTION_KEYS')
+    parser.add_argument('--units', type=parse_counts, default={}, help='type=count,... of UNITS_KEYS')
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--split', type=lambda x: [float(i) for i in x.split(',')], help='player weights, e.g. 3,1')
+    parser.add_argument('--clusters', type=int, default=0, help='number of resource clusters, 0 to spread evenly')
+    parser.add_argument('--no-kings', action='store_true')
+    args = parser.parse_args(argv)
+    if args.split and len(args.split) != args.players:
+        sys.exit('--split needs one weight per player')
+    if args.preset:
+        preset = PRESETS[args.preset]
+        args.width, args.height = preset['width'], preset['height']
+        args.collected, args.constructions, args.units = preset['collected'], preset['constructions'], preset['units']
+    generator = LevelGenerator(args.width, args.height, args.seed, args.players, args.split, args.clusters)
+    level = generator.generate(args.collected, args.constructions, args.units, not args.no_kings)
+    level_format.save(level, args.target)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+import heapq
+import math
+from array import array
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Tuple
+
+from src import core
+
+Cell = Tuple[int, int]
+DIAGONAL = math.sqrt(2)
+NEIGHBOURS = (
+    (1, 0, 1), (-1, 0, 1), (0, 1, 1), (0, -1, 1),
+    (1, 1, DIAGONAL), (1, -1, DIAGONAL), (-1, 1, DIAGONAL), (-1, -1, DIAGONAL),
+)
+
+
+def octile(a: Cell, b: Cell) -> float:
+    dx, dy = abs(a[0] - b[0]), abs(a[1] - b[1])
+    return max(dx, dy) + (DIAGONAL - 1) * min(dx, dy)
+
+
+class Grid:
+    """The level's tiles with the number of obstacles on each of them."""
+
+    def __init__(self, width: int, height: int, tile_size: int = 64, log_size: int = 1024):
+        self.tile_size = tile_size
+        self.cols = max(1, (width + tile_size - 1) // tile_size)
+        self.rows = max(1, (height + tile_size - 1) // tile_size)
+        self.obstacles = array('H', bytes(2 * self.cols * self.rows))
+        # counts the cells that became blocked, the log tells which ones for recent versions
+        self.version = 0
+        self.log: deque = deque(maxlen=log_size)
+
+    def cell(self, point) -> Cell:
+        col = min(max(0, int(point[0]) // self.tile_size), self.cols - 1)
+        row = min(max(0, int(point[1]) // self.tile_size), self.rows - 1)
+        return col, row
+
+    def center(self, cell: Cell) -> Tuple[float, float]:
+        return (cell[0] + 0.5) * self.tile_size, (cell[1] + 0.5) * self.tile_size
+
+    def contains(self, point) -> bool:
+        return 0 <= point[0] < self.cols * self.tile_size and 0 <= point[1] < self.rows * self.tile_size
+
+    def inside(self, cell: Cell) -> bool:
+        return 0 <= cell[0] < self.cols and 0 <= cell[1] < self.rows
+
+    def is_blocked(self, cell: Cell) -> bool:
+        return self.obstacles[cell[1] * self.cols + cell[0]] > 0
+
+    def nearest_free(self, cell: Cell, exclude=()) -> Cell or None:
+        """The free tile closest to cell that is not in exclude, None when there is none."""
+        x, y = cell
+        for radius in range(max(self.cols, self.rows)):
+            best, best_distance = None, math.inf
+            for cx in range(x - radius, x + radius + 1):
+                for cy in range(y - radius, y + radius + 1):
+                    if max(abs(cx - x), abs(cy - y)) != radius:
+                        continue
+                    candidate = cx, cy
+                    if not self.inside(candidate) or self.is_blocked(candidate) or candidate in exclude:
+                        continue
+                    distance = (cx - x) ** 2 + (cy - y) ** 2
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+            if best is not None:
+                return best
+        return None
+
+    def cells_of(self, rect: core.Rect) -> Tuple[Cell, ...]:
+        # a tile is blocked when the obstacle covers its center area, not when it only touches it
+        inner = rect.inflate(-self.tile_size // 2, -self.tile_size // 2)
+        if inner.w <= 0 or inner.h <= 0:
+            return self.cell(rect.center),
+        left, top = self.cell(inner.topleft)
+        right, bottom = self.cell((inner.right - 1, inner.bottom - 1))
+        return tuple((x, y) for x in range(left, right + 1) for y in range(top, bottom + 1))
+
+    def block(self, rect: core.Rect) -> Tuple[Cell, ...]:
+        cells = self.cells_of(rect)
+        for cell in cells:
+            index = cell[1] * self.cols + cell[0]
+            self.obstacles[index] += 1
+            if self.obstacles[index] == 1:
+                self.version += 1
+                self.log.append((self.version, cell))
+        return cells
+
+    def unblock(self, cells: Tuple[Cell, ...]):
+        # freed cells never break a known path, so they do not change the version
+        for cell in cells:
+            self.obstacles[cell[1] * self.cols + cell[0]] -= 1
+
+    def blocked_since(self, version: int) -> List[Cell] or None:
+        """Cells blocked after version, None when the log does not reach back that far."""
+        if version == self.version:
+            return []
+        if not self.log or self.log[0][0] > version + 1:
+            return None
+        return [cell for cell_version, cell in self.log if cell_version > version]
+
+
+class PathTree:
+    """Next steps towards one goal, every path found to it adds to the tree."""
+
+    def __init__(self, goal: Cell, version: int):
+        self.goal = goal
+        self.version = version
+        self.next: Dict[Cell, Cell] = {}
+
+    def path(self, start: Cell) -> List[Cell]:
+        cells = [start]
+        cell = start
+        while cell != self.goal:
+            cell = self.next[cell]
+            cells.append(cell)
+        return cells
+
+    def add(self, cells: List[Cell]):
+        for cell, step in zip(cells, cells[1:]):
+            self.next.setdefault(cell, step)
+
+
+class FlowField:
+    """Distances to one goal tile over a region of the grid, every tile points to its next step towards the goal."""
+
+    def __init__(self, grid: Grid, goal: Cell, region: Tuple[int, int, int, int]):
+        self.grid = grid
+        self.goal = goal
+        self.version = grid.version
+        # left, top, right, bottom tiles, all included
+        self.region = region
+        left, top, right, bottom = region
+        self.width = right - left + 1
+        self.height = bottom - top + 1
+        size = self.width * self.height
+        self.distance = array('d', [math.inf]) * size
+        self.next = array('i', [-1]) * size
+        self.integrate()
+
+    def index(self, cell: Cell) -> int:
+        return (cell[1] - self.region[1]) * self.width + cell[0] - self.region[0]
+
+    def cell(self, index: int) -> Cell:
+        return index % self.width + self.region[0], index // self.width + self.region[1]
+
+    def covers(self, cell: Cell) -> bool:
+        left, top, right, bottom = self.region
+        return left <= cell[0] <= right and top <= cell[1] <= bottom
+
+    def integrate(self):
+        # Dijkstra wavefront from the goal, with the same moves as the A* search
+        grid, distance, next_step = self.grid, self.distance, self.next
+        goal = self.index(self.goal)
+        distance[goal] = 0
+        queue = [(0.0, goal)]
+        while queue:
+            d, index = heapq.heappop(queue)
+            if d > distance[index]:
+                continue
+            x, y = self.cell(index)
+            for dx, dy, step in NEIGHBOURS:
+                neighbour = x + dx, y + dy
+                if not self.covers(neighbour) or grid.is_blocked(neighbour):
+                    continue
+                if dx and dy and (grid.is_blocked((x + dx, y)) or grid.is_blocked((x, y + dy))):
+                    continue
+                neighbour_index = self.index(neighbour)
+                if d + step < distance[neighbour_index]:
+                    distance[neighbour_index] = d + step
+                    next_step[neighbour_index] = index
+                    heapq.heappush(queue, (d + step, neighbour_index))
+
+    def step(self, cell: Cell) -> Cell or None:
+        """The next tile from cell towards the goal, None at the goal or where the field does not lead anywhere."""
+        if cell == self.goal or not self.covers(cell):
+            return None
+        index = self.next[self.index(cell)]
+        if index >= 0:
+            return self.cell(index)
+        # a unit standing on an obstacle steps to the neighbour closest to the goal
+        best, best_distance = None, math.inf
+        for dx, dy, _ in NEIGHBOURS:
+            neighbour = cell[0] + dx, cell[1] + dy
+            if self.covers(neighbour):
+                d = self.distance[self.index(neighbour)]
+                if d < best_distance:
+                    best, best_distance = neighbour, d
+        return best
+
+    def is_valid(self) -> bool:
+        if self.version == self.grid.version:
+            return True
+        blocked = self.grid.blocked_since(self.version)
+        if blocked is None or any(self.covers(cell) and cell != self.goal for cell in blocked):
+            return False
+        self.version = self.grid.version
+        return True
+
+
+class PathFinder:
+    """A* over the tile grid, with the paths to every goal shared between the units going there.
+
+    Requests are searched on the AI scheduler, so they are spread over frames under its budget. Requests for the same
+    start and goal tile that wait at the same time are searched once.
+    """
+    # nodes expanded by one search, a search that gives up returns the path to the closest node it reached
+    max_nodes: int = 4000
+    max_trees: int = 256
+    max_fields: int = 32
+    # tiles a flow field reaches beyond the units and the goal it was made for
+    field_margin: int = 8
+
+    def __init__(self, game: core.Game, grid: Grid):
+        self.game = game
+        self.grid = grid
+        self.trees: OrderedDict = OrderedDict()
+        self.pending: Dict[Tuple[Cell, Cell], list] = {}
+        self.fields: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.field_hits = 0
+        self.field_misses = 0
+
+    def stats(self) -> Tuple[int, int]:
+        return self.hits, self.misses
+
+    def field_stats(self) -> Tuple[int, int]:
+        return self.field_hits, self.field_misses
+
+    def flow_field(self, goal, starts) -> FlowField:
+        """A field towards goal that covers every start point, shared by all the units sent there."""
+        grid = self.grid
+        goal = grid.cell(goal)
+        cells = [grid.cell(point) for point in starts] + [goal]
+        margin = self.field_margin
+        region = (max(0, min(x for x, _ in cells) - margin), max(0, min(y for _, y in cells) - margin),
+                  min(grid.cols - 1, max(x for x, _ in cells) + margin),
+                  min(grid.rows - 1, max(y for _, y in cells) + margin))
+        field = self.fields.get(goal)
+        if field is not None and field.is_valid() and all(field.covers(cell) for cell in cells):
+            self.field_hits += 1
+            self.fields.move_to_end(goal)
+            return field
+        self.field_misses += 1
+        field = self.fields[goal] = FlowField(grid, goal, region)
+        self.fields.move_to_end(goal)
+        if len(self.fields) > self.max_fields:
+            self.fields.popitem(last=False)
+        return field
+
+    def request(self, start, goal, callback: Callable, *args):
+        """Calls callback(points, *args) with the tile centers to walk through, start and goal tiles excluded."""
+        key = self.grid.cell(start), self.grid.cell(goal)
+        cells = self.cached(*key)
+        if cells is not None:
+            self.hits += 1
+            callback(self.points(cells), *args)
+            return
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = []
+            self.game.ai.add(self.resolve, 0, key, delay=0)
+        pending.append((callback, args))
+
+    def resolve(self, key: Tuple[Cell, Cell]) -> bool:
+        callbacks = self.pending.pop(key)
+        cells = self.cached(*key)
+        if cells is None:
+            self.misses += 1
+            cells = self.search(*key)
+        else:
+            self.hits += 1
+        points = self.points(cells)
+        for callback, args in callbacks:
+            callback(list(points), *args)
+        return False
+
+    def points(self, cells: List[Cell]) -> List[Tuple[float, float]]:
+        return [self.grid.center(cell) for cell in cells[1:-1]]
+
+    def tree(self, goal: Cell) -> PathTree or None:
+        tree = self.trees.get(goal)
+        if tree is None:
+            return None
+        if tree.version != self.grid.version:
+            blocked = self.grid.blocked_since(tree.version)
+            if blocked is None or any(cell in tree.next for cell in blocked):
+                del self.trees[goal]
+                return None
+            tree.version = self.grid.version
+        self.trees.move_to_end(goal)
+        return tree
+
+    def cached(self, start: Cell, goal: Cell) -> List[Cell] or None:
+        if start == goal:
+            return [start]
+        tree = self.tree(goal)
+        if tree is None or start not in tree.next:
+            return None
+        return tree.path(start)
+
+    def search(self, start: Cell, goal: Cell) -> List[Cell]:
+        grid = self.grid
+        tree = self.tree(goal)
+        came: Dict[Cell, Cell] = {}
+        cost = {start: 0.0}
+        queue = [(octile(start, goal), 0, start)]
+        sequence = 1
+        closest, closest_h = start, octile(start, goal)
+        expanded = 0
+        reached = None
+        closed = set()
+        while queue and expanded < self.max_nodes:
+            _, _, cell = heapq.heappop(queue)
+            if cell in closed:
+                continue
+            if cell == goal or (tree is not None and cell in tree.next):
+                reached = cell
+                break
+            closed.add(cell)
+            expanded += 1
+            h = octile(cell, goal)
+            if h < closest_h:
+                closest, closest_h = cell, h
+            x, y = cell
+            for dx, dy, step in NEIGHBOURS:
+                neighbour = x + dx, y + dy
+                if not grid.inside(neighbour):
+                    continue
+                # the goal itself may be an obstacle, e.g. a tree a slave walks to
+                if neighbour != goal and grid.is_blocked(neighbour):
+                    continue
+                if dx and dy and (grid.is_blocked((x + dx, y)) or grid.is_blocked((x, y + dy))):
+                    continue
+                g = cost[cell] + step
+                if g < cost.get(neighbour, math.inf):
+                    cost[neighbour] = g
+                    came[neighbour] = cell
+                    heapq.heappush(queue, (g + octile(neighbour, goal), sequence, neighbour))
+                    sequence += 1
+        end = reached if reached is not None else closest
+        cells = [end]
+        while cells[-1] != start:
+            cells.append(came[cells[-1]])
+        cells.reverse()
+        if reached is None:
+            # the points of a path exclude the goal tile, so the partial path still ends at its closest tile
+            return cells + [goal]
+        if reached != goal:
+            cells.extend(tree.path(reached)[1:])
+        if tree is None:
+            tree = self.trees[goal] = PathTree(goal, grid.version)
+            if len(self.trees) > self.max_trees:
+                self.trees.popitem(last=False)
+        tree.add(cells)
+        return cells
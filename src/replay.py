@@ -0,0 +1,155 @@
+import json
+import os
+import zlib
+from typing import List, Tuple
+
+import pygame
+
+VERSION = 2
+# pygame.key.get_pressed() is indexed by scancode but the game asks it for keycodes, so the keycodes are recorded
+KEYS = sorted({value for name, value in vars(pygame).items() if name.startswith('K_')})
+
+
+class KeyState:
+
+    def __init__(self, pressed=()):
+        self.pressed = frozenset(pressed)
+
+    def __getitem__(self, key: int) -> bool:
+        return key in self.pressed
+
+
+def plain(value) -> bool:
+    if isinstance(value, (tuple, list)):
+        return all(plain(i) for i in value)
+    return value is None or isinstance(value, (bool, int, float, str))
+
+
+def serialize_event(event) -> list:
+    return [event.type, {key: value for key, value in event.dict.items() if plain(value)}]
+
+
+def deserialize_event(data) -> pygame.event.Event:
+    event_type, attributes = data
+    return pygame.event.Event(event_type, {key: tuple(value) if isinstance(value, list) else value
+                                           for key, value in attributes.items()})
+
+
+class Replay:
+
+    def __init__(self, seed: int, level: str, window_size, viewport_size):
+        self.seed = seed
+        self.level = level
+        self.window_size = tuple(window_size)
+        self.viewport_size = tuple(viewport_size)
+        # the clock delta of every tick
+        self.deltas: List[int] = []
+        # [tick, mouse or None, pressed keys or None, events or None], only for ticks where something changed
+        self.inputs: List[list] = []
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def save(self, path: str):
+        data = {
+            'version': VERSION,
+            'seed': self.seed,
+            'level': self.level,
+            'window_size': self.window_size,
+            'viewport_size': self.viewport_size,
+            'deltas': self.deltas,
+            'inputs': self.inputs,
+        }
+        with open(path, 'wb') as file:
+            file.write(zlib.compress(json.dumps(data, separators=(',', ':')).encode(), 9))
+
+    @classmethod
+    def load(cls, path: str) -> 'Replay':
+        with open(path, 'rb') as file:
+            data = json.loads(zlib.decompress(file.read()))
+        if data['version'] != VERSION:
+            raise ValueError(f'unsupported replay version {data["version"]}')
+        replay = cls(data['seed'], data['level'], data['window_size'], data['viewport_size'])
+        replay.deltas = data['deltas']
+        replay.inputs = data['inputs']
+        return replay
+
+
+class Recorder:
+
+    def __init__(self, replay: Replay, path: str = None):
+        self.replay = replay
+        self.path = path
+        self.events: List[list] = []
+        self.mouse = None
+        self.keys = None
+
+    def add_event(self, event):
+        self.events.append(serialize_event(event))
+
+    def end_tick(self, delta: float, mouse, keys):
+        tick = len(self.replay.deltas)
+        self.replay.deltas.append(int(round(delta)))
+        mouse = tuple(mouse)
+        pressed = [key for key in KEYS if keys[key]]
+        entry = [tick, None, None, None]
+        if mouse != self.mouse:
+            entry[1] = self.mouse = mouse
+        if pressed != self.keys:
+            entry[2] = self.keys = pressed
+        if self.events:
+            entry[3], self.events = self.events, []
+        if entry[1:] != [None, None, None]:
+            self.replay.inputs.append(entry)
+
+    def save(self):
+        if self.path is not None:
+            self.replay.save(self.path)
+
+
+class Player:
+
+    def __init__(self, replay: Replay):
+        self.replay = replay
+        self.index = 0
+        self.mouse: Tuple[int, int] = (0, 0)
+        self.keys = KeyState()
+
+    def finished(self, tick: int) -> bool:
+        return tick >= len(self.replay.deltas)
+
+    def delta(self, tick: int) -> int:
+        return self.replay.deltas[tick]
+
+    def events(self, tick: int) -> List[pygame.event.Event]:
+        inputs = self.replay.inputs
+        if self.index >= len(inputs) or inputs[self.index][0] != tick:
+            return []
+        _, mouse, keys, events = inputs[self.index]
+        self.index += 1
+        if mouse is not None:
+            self.mouse = tuple(mouse)
+        if keys is not None:
+            self.keys = KeyState(keys)
+        return [deserialize_event(i) for i in events or ()]
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Re-run a recorded match tick for tick')
+    parser.add_argument('replay')
+    parser.add_argument('--headless', action='store_true', help='run without a window, as fast as possible')
+    args = parser.parse_args(argv)
+    if args.headless:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+    from src import zulu_doodmaak
+    replay = Replay.load(args.replay)
+    game = zulu_doodmaak.create_game(replay.window_size, replay.viewport_size, False, replay.seed, replay.level)
+    game.play(replay)
+    game.start(zulu_doodmaak.FILL, realtime=not args.headless)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,12 @@
-import random
-from typing import List, Iterator
+import math
+import os
+from array import array
+from collections import deque
+from typing import List, Iterator, Dict, Tuple
 
 import pygame
-import json
 
-from src import core
+from src import combat, core, diagnostics, formation, influence, level_format, pathfinding
 
 
 def get_system_screensize():
@@ -21,12 +23,13 @@ def hex2rgb(h):
 
 
 class Particle(core.Sprite):
+    z_index = 3
 
     def __init__(self, game, point, animation: str, border_rect=None, dx=0, dy=1, live_time: float = 10000, gravity: float = 0.5, scale=1):
         super().__init__(game)
         self.set_animation(animation)
         self.rect.center = point
-        self.live_time = live_time
+        self.game.scheduler.after(live_time, self.kill)
         self.gravity = gravity
         self.velocity = [dx, dy]
         self.scale = scale
@@ -35,9 +38,6 @@ class Particle(core.Sprite):
                         int(self.rect.size[1] * scale)]
 
     def process(self, delta):
-        self.live_time -= delta
-        if self.live_time <= 0:
-            return self.kill()
         self.velocity[1] += self.gravity
         self.rect.x += self.velocity[0]
         self.rect.y += self.velocity[1]
@@ -63,6 +63,8 @@ class Particles(core.Object):
         self.max_scale = max_scale
         self.animation = animation
         self.count = count
+        # an emitter only spawns particles when played
+        self.sleep()
 
     def set_animation(self, animation):
         [i.set_animation(animation) for i in self.particles]
@@ -74,14 +76,23 @@ class Particles(core.Object):
             self.particles.append(sprite)
             sprite.set_animation(animation)
 
+    def play_at(self, point, rect):
+        # lets one emitter serve many objects, e.g. the blood of every unit
+        self.point = point
+        self.rect = rect
+        self.play()
+        # the particles keep copies of rect, holding on to it would keep the last unit hit alive
+        self.rect = None
+
     def play(self):
         self.particles = []
         for i in range(self.count):
-            self.particles.append(Particle(self.game, self.point, self.animation, self.rect, dx=random.uniform(
-                -3, 3), scale=random.uniform(self.min_scale, self.max_scale), live_time=self.live_time))
+            self.particles.append(Particle(self.game, self.point, self.animation, self.rect, dx=self.game.random.uniform(
+                -3, 3), scale=self.game.random.uniform(self.min_scale, self.max_scale), live_time=self.live_time))
 
 
 class ButtonImage(core.Sprite):
+    z_index = 5
 
     def __init__(self, game: 'Game', button: 'NativeButton', animation):
         super().__init__(game)
@@ -96,6 +107,8 @@ class ButtonImage(core.Sprite):
 
 
 class NativeButton(core.Drawing):
+    events = (pygame.MOUSEMOTION, pygame.MOUSEBUTTONUP)
+    z_index = 4
     is_hover: bool = False
 
     def __init__(self, game, rect, color="#ccc", hover_color="#bbb", animation=None, click_callback=None):
@@ -106,9 +119,15 @@ class NativeButton(core.Drawing):
         self.hover_color = hex2rgb(hover_color)
         self.hidden = False
         self.click_callback = click_callback
+        self.sprite = None
         if animation is not None:
             self.sprite = ButtonImage(self.game, self, animation)
 
+    def kill(self):
+        super().kill()
+        if self.sprite is not None:
+            self.sprite.kill()
+
     def process(self, delta: float) -> None:
         if self.hidden:
             return
@@ -146,13 +165,17 @@ COLLECTED_TYPES = {
 
 
 class Field(core.Sprite):
+    z_index = 0
     fields = ['field_1', 'field_2']
 
-    def __init__(self, game, left, top):
+    def __init__(self, game, left, top, field=None):
         super().__init__(game)
-        self.set_animation(random.choice(self.fields))
+        if field is None:
+            field = game.random.choice(self.fields)
+        self.set_animation(field)
         self.rect.x = self.rect.width * left
         self.rect.y = self.rect.height * top
+        self.sleep()
 
     def process(self, delta: float) -> None:
         self.draw()
@@ -160,27 +183,58 @@ class Field(core.Sprite):
 
 class Accessible(core.Drawing):
 
-    def stop_access(self):
+    def stop_access(self, unit):
         pass
 
 
+class Obstacle(core.Drawing):
+    # the tiles of the path grid this blocks
+    blocked: tuple = ()
+
+    def block(self):
+        if not self.blocked:
+            self.blocked = self.game.pathfinder.grid.block(self.rect)
+
+    def unblock(self):
+        if self.blocked:
+            self.game.pathfinder.grid.unblock(self.blocked)
+            self.blocked = ()
+
+
 class Flammable(core.Drawing):
     is_burning: bool = False
-    burning_time: int = 0
+    burning_time: int = 5000
 
     def __init__(self, game, left=0, top=0):
         super().__init__(game, left, top)
+        # only exists while burning
+        self.fire: core.Sprite or None = None
+
+    def ignite(self):
+        if self.is_burning:
+            return
+        self.is_burning = True
         self.fire = core.Sprite(self.game)
+        self.fire.z_index = 2
         self.fire.rect = self.rect
         self.fire.set_animation('fire')
+        # drawn by the burning object itself
+        self.fire.sleep(False)
+        self.wake()
+        self.game.scheduler.after(self.burning_time, self.burn_out)
+
+    def burn_out(self):
+        self.is_burning = False
+        self.fire.kill()
+        self.fire = None
+        self.sleep()
 
     def process(self, delta: float) -> None:
         if self.is_burning:
-            self.burning_time += delta
             self.fire.draw()
 
 
-class Collected(core.Sprite, Accessible):
+class Collected(core.Sprite, Accessible, Obstacle):
     not_collected_animations: List[str]
     not_collected_animation: str
 
@@ -188,58 +242,92 @@ class Collected(core.Sprite, Accessible):
     collected_animation: str
 
     is_collected: bool = False
+    # the unit that reserved this, from the moment it was sent here until it is collected
     collector = None
 
     material: int
+    # whether units have to walk around it while it is not collected
+    blocking: bool = False
     collecting_time: int
     recovery_time: int
-    left_for_recover: int = 0
-    left_for_collect: int = 0
+    # the pending collect or recover of this collectable
+    timer: core.Timer or None = None
     amount: int
 
     def __init__(self, game: core.Game, left=0, top=0):
         super().__init__(game, left, top)
-        self.not_collected_animation = random.choice(
+        self.not_collected_animation = game.random.choice(
             self.not_collected_animations)
-        self.collected_animation = random.choice(self.collected_animations)
+        self.collected_animation = game.random.choice(self.collected_animations)
         self.recover()
+        # collecting and recovering run on timers, only a burning tree needs its process
+        self.sleep()
+
+    def is_idle(self) -> bool:
+        return self.is_free()
+
+    def is_free(self) -> bool:
+        return not self.is_collected and self.collector is None
+
+    @property
+    def is_collecting(self) -> bool:
+        return self.timer is not None and not self.is_collected
 
     def recover(self):
         self.is_collected = False
+        self.timer = None
         self.set_animation(self.not_collected_animation)
+        self.game.collectables.update(self)
+        if self.blocking:
+            self.block()
 
     def collect(self):
         self.is_collected = True
         self.stop_collect()
         self.set_animation(self.collected_animation)
+        self.unblock()
+
+    def reserve(self, unit) -> bool:
+        if self.is_collected or self.collector not in (None, unit):
+            return False
+        self.collector = unit
+        self.game.collectables.update(self)
+        return True
 
     def start_collect(self, collector) -> bool:
-        if self.is_collected:
+        if not self.reserve(collector):
             return False
-        self.left_for_collect = self.collecting_time
-        self.collector = collector
+        if self.timer is None:
+            self.timer = self.game.scheduler.after(self.collecting_time, self.collect)
         return True
 
-    def stop_access(self):
-        self.stop_collect()
+    def stop_access(self, unit):
+        if self.collector is unit:
+            self.stop_collect()
 
     def stop_collect(self):
-        self.left_for_recover = self.recovery_time
         self.collector = None
+        self.cancel_timer()
+        if self.is_collected:
+            self.timer = self.game.scheduler.after(self.recovery_time, self.recover)
+        self.game.collectables.update(self)
+
+    def kill(self):
+        super().kill()
+        self.game.collectables.update(self)
+        self.unblock()
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
 
     def process(self, delta: float) -> None:
-        if self.collector is not None:
-            self.left_for_collect -= delta
-            if self.left_for_collect <= 0:
-                self.collect()
-        elif self.is_collected:
-            self.left_for_recover -= delta
-            if self.left_for_recover <= 0:
-                self.recover()
         self.draw()
 
 
 class Stone(Collected):
+    blocking = True
     recovery_time: int = 45 * 1000
     material = COLLECTED_TYPES['stone']
     collecting_time: int = 6 * 1000
@@ -274,16 +362,19 @@ class BigFoodField(FoodField):
 
 
 class Tree(Collected, Flammable):
+    blocking = True
     recovery_time: int = 45 * 1000
     collected_animations = ['stump']
     material = COLLECTED_TYPES['wood']
 
+    def is_idle(self) -> bool:
+        return super().is_idle() and not self.is_burning
+
+    def burn_out(self):
+        self.collect()
+        super().burn_out()
+
     def process(self, delta: float) -> None:
-        self.draw()
-        if self.burning_time >= 5000:
-            self.collect()
-            self.burning_time = 0
-            self.is_burning = False
         Collected.process(self, delta)
         Flammable.process(self, delta)
 
@@ -300,7 +391,44 @@ class BigTree(Tree):
     not_collected_animations = ['tree_2', 'tree_4']
 
 
+class CollectedIndex:
+    """The free collectables of every material, for nearest free collectable queries."""
+    cell_size: int = 256
+    # a collectable is bucketed by its center, its edge may be this much closer than the center
+    margin: int = 128
+
+    def __init__(self):
+        self.materials: Dict[int, core.SpatialHash] = {}
+
+    def __len__(self):
+        return sum(len(i) for i in self.materials.values())
+
+    def free(self) -> List[Tuple[Tuple[int, int], int]]:
+        return [(collected.rect.center, collected.amount) for grid in self.materials.values() for collected in grid]
+
+    def update(self, collected: Collected):
+        grid = self.materials.get(collected.material)
+        if grid is None:
+            grid = self.materials[collected.material] = core.SpatialHash(self.cell_size)
+        if collected.alive and collected.is_free():
+            grid.insert(collected, collected.rect.center)
+        else:
+            grid.remove(collected)
+
+    def nearest(self, rect: core.Rect, max_distance: float, material: int = None) -> Collected or None:
+        grids = self.materials.values() if material is None else filter(None, [self.materials.get(material)])
+        best, best_key = None, None
+        for grid in grids:
+            collected = grid.nearest(rect.center, max_distance, lambda i: rect.get_distance(i.rect), self.margin)
+            if collected is not None:
+                key = rect.get_distance(collected.rect), collected.seq
+                if best_key is None or key < best_key:
+                    best, best_key = collected, key
+        return best
+
+
 class Player(core.Object):
+    events = (combat.DEATH,)
     is_defeated: bool = False
 
     def __init__(self, game, color):
@@ -315,54 +443,83 @@ class Player(core.Object):
         if isinstance(unit, King):
             self.king = unit
 
-    def process(self, delta: float) -> None:
-        if self.is_defeated:
-            return
-        if self.king and self.king.hp <= 0:
+    def event(self, event) -> None:
+        if event.unit is self.king:
             self.is_defeated = True
+            self.king = None
 
 
 class Bot(Player):
+    # how often every unit of the bot looks for something to do
+    think_interval: int = 250
+    # how far an idle slave looks for resources, in influence map cells
+    forage_cells: int = 6
+    # a lancer does not attack into a cell where the enemy is this many times stronger than the bot
+    courage: float = 2
 
-    def process(self, delta: float) -> None:
-        super().process(delta)
-        if self.is_defeated:
-            return
+    def __init__(self, game, color):
+        super().__init__(game, color)
+        self.tasks: Dict['Unit', core.Task] = {}
+
+    def add_unit(self, unit: 'Selectable'):
+        super().add_unit(unit)
+        if isinstance(unit, (Slave, Lancer)):
+            self.tasks[unit] = self.game.ai.add(self.think, self.think_interval, unit)
+
+    def event(self, event) -> None:
+        super().event(event)
+        task = self.tasks.pop(event.unit, None)
+        if task is not None:
+            task.cancel()
+        # the lancers that were after the dead unit look for another one right away
         for unit in self.units:
-            if isinstance(unit, Slave) and unit.goal is None:
-                md = -1
-                mcol = None
-                for collected in self.game.game_objects:
-                    if isinstance(collected,
-                                  Collected) and collected.collector is None and not collected.is_collected:
-                        d = unit.rect.get_distance(collected.rect)
-                        if (md == -1 or d < md) and d < 200:
-                            md = d
-                            mcol = collected
-                if mcol:
-                    unit.set_goal(mcol)
-            elif isinstance(unit, Lancer) and unit.goal is None:
-                md = -1
-                mcol = None
-                for enemy in self.game.game_objects:
-                    if isinstance(enemy,
-                                  Unit) and enemy.player != self and enemy.hp > 0:
-                        d = unit.rect.get_distance(enemy.rect)
-                        if (md == -1 or d < md) and d < 100:
-                            md = d
-                            mcol = enemy
-                if mcol:
-                    unit.set_goal(mcol)
+            if isinstance(unit, Lancer) and unit.goal is event.unit:
+                unit.goal = None
+                self.think(unit)
+
+    def think(self, unit: 'Unit') -> bool:
+        if self.is_defeated or unit.hp <= 0:
+            return False
+        if unit.goal is not None:
+            return True
+        if isinstance(unit, Slave):
+            collected = self.game.collectables.nearest(unit.rect, 200)
+            if collected:
+                unit.set_goal(collected)
+            elif unit.direction == (0, 0):
+                # nothing free around, walk towards the richest part of the map nearby
+                point = self.game.influence.richest_cell(unit.rect.center, self.forage_cells)
+                if point is not None:
+                    unit.set_target(point)
+        else:
+            influence_map = self.game.influence
+            enemies = [enemy for enemy in influence_map.enemies_near(self, unit.rect.center)
+                       if isinstance(enemy, Unit) and unit.rect.get_distance(enemy.rect) < 100
+                       and influence_map.enemy(self, enemy.rect.center) <=
+                       self.courage * influence_map.friendly(self, enemy.rect.center)]
+            if enemies:
+                unit.set_goal(min(enemies, key=lambda enemy: (self.target_score(unit, enemy), enemy.seq)))
+        return True
+
+    def target_score(self, unit: 'Unit', enemy: 'Unit') -> float:
+        # lower is better, close and weak enemies first and the king above all
+        score = unit.rect.get_distance(enemy.rect) + enemy.hp * 5
+        if isinstance(enemy, King):
+            score -= 200
+        return score
 
 
 class Selectable(core.Sprite, Accessible):
+    z_index = 2
     hp: int
-    is_selected: bool
+    attack: int = 0
+    _selected: bool = False
 
     def __init__(self, game, player, max_hp, left=0, top=0):
         super().__init__(game, left, top)
         player.add_unit(self)
-        self.hp_panel = core.Drawing(self.game)
+        # only exists while selected
+        self.hp_panel: core.Drawing or None = None
         self.is_selected = False
         self.player: Player = player
         self.max_hp: int = max_hp
@@ -373,132 +530,288 @@ class Selectable(core.Sprite, Accessible):
             "food": 0
         }
 
+    @property
+    def is_selected(self) -> bool:
+        return self._selected
+
+    @is_selected.setter
+    def is_selected(self, value: bool):
+        if value and self.hp <= 0:
+            return
+        self._selected = value
+        if value:
+            self.wake()
+
     def process(self, delta: float) -> None:
+        if not self.is_selected:
+            if self.hp_panel is not None:
+                self.hp_panel.kill()
+                self.hp_panel = None
+            return
+        if self.hp_panel is None:
+            self.hp_panel = core.Drawing(self.game, z_index=3)
+            self.hp_panel.sleep(False)
         self.hp_panel.surface = pygame.Surface((self.rect.w, 5))
+        if self.game.surface_tracker is not None:
+            self.game.surface_tracker.add(self.hp_panel.surface, 'Selectable')
         self.hp_panel.rect = self.rect.copy()
         self.hp_panel.rect.size = self.hp_panel.surface.get_size()
         self.hp_panel.rect.y -= 10
-        if self.is_selected:
-            self.hp_panel.surface.fill((255, 0, 0))
-            pygame.draw.rect(self.hp_panel.surface, (0, 255, 0),
-                             (0, 0, self.hp / self.max_hp * self.hp_panel.rect.w, 5))
-            self.hp_panel.draw()
+        self.hp_panel.surface.fill((255, 0, 0))
+        pygame.draw.rect(self.hp_panel.surface, (0, 255, 0),
+                         (0, 0, self.hp / self.max_hp * self.hp_panel.rect.w, 5))
+        self.hp_panel.draw()
 
 
-class Construction(Selectable):
+class Construction(Selectable, Obstacle):
 
     def __init__(self, game, player: Player, construction_type, max_hp, left=0, top=0):
         super().__init__(game, player, max_hp, left, top)
         self.construction_type: str = construction_type
         animation = f'{self.player.color}_{self.construction_type}'
         self.set_animation(animation)
+        self.block()
 
     def process(self, delta: float) -> None:
         if self.hp <= 0:
-            return
+            self.unblock()
+            return self.sleep(False)
         self.draw()
         super().process(delta)
+        if not self.is_selected:
+            # an idle construction is only drawn, selecting or damaging it wakes it up
+            self.sleep()
 
 
 class Barracks(Construction):
 
     def __init__(self, game, player: Player, left=0, top=0):
         super().__init__(game, player, 'barracks', 120, left, top)
-        btn_r = core.Rect(0, 0, 50, 50)
-        btn_r.centery = self.rect.centery
-        btn_r.x = self.rect.right + 10
-        hero = f'{self.player.color}_lancer'
-        self.btn = NativeButton(self.game, btn_r, "#fff",
-                                "eee", hero, self.buy_lancer)
+        # only exists while selected
+        self.btn: NativeButton or None = None
 
     def process(self, delta: float) -> None:
         super().process(delta)
         if self.is_selected:
-            self.btn.hidden = False
-        else:
-            self.btn.hidden = True
+            if self.btn is None:
+                btn_r = core.Rect(0, 0, 50, 50)
+                btn_r.centery = self.rect.centery
+                btn_r.x = self.rect.right + 10
+                hero = f'{self.player.color}_lancer'
+                self.btn = NativeButton(self.game, btn_r, "#fff",
+                                        "eee", hero, self.buy_lancer)
+        elif self.btn is not None:
+            self.btn.kill()
+            self.btn = None
 
     def buy_lancer(self):
         self.is_selected = False
         if Lancer.cost['food'] <= self.player.resources[COLLECTED_TYPES["food"]]:
             Lancer(self.game, self.player, left=self.rect.right +
                    30, top=self.rect.centery)
+            self.game.tracer.instant('spawn', {'unit': 'Lancer', 'player': self.player.color})
             self.player.resources[COLLECTED_TYPES["food"]
                                   ] -= Lancer.cost['food']
             self.game.set_texts()
 
 
 class Unit(Selectable):
+    waypoint_radius: int = 4
+    attack_interval: int = 0
 
     def __init__(self, game, player: Player, unit_type, speed, max_hp, left=0, top=0):
+        # hit points live in the game's combat arrays, so they exist before Selectable sets them
+        self.fighter: int or None = game.combat.add(self, max_hp, self.attack, self.attack_interval)
         super().__init__(game, player, max_hp, left, top)
         self.goal: Accessible or None = None
         self.target = None
         self.direction = (0, 0)
+        # waypoints around the obstacles on the way to target, and the tile they lead to
+        self.path: deque = deque()
+        self.path_cell = None
+        # the flow field of a group order, used instead of a path of its own, and the tile it currently leads to
+        self.flow: pathfinding.FlowField or None = None
+        self.flow_step = None
         self.unit_type: str = unit_type
         self.speed: int = speed
         animation = f'{self.player.color}_{self.unit_type}'
         self.set_animation(animation)
+        self.rect = core.Collider(self, self.rect)
+        self.game.collisions.add(self.rect)
         self.x, self.y = self.rect.topleft
-        self.blood = Particles(self.game, self.rect.center,
-                               'blood', self.rect, min_scale=0.05, max_scale=0.1)
+
+    @property
+    def hp(self) -> int:
+        # a dead unit has no slot any more, it may already belong to another unit
+        return 0 if self.fighter is None else int(self.game.combat.hp[self.fighter])
+
+    @hp.setter
+    def hp(self, value: int):
+        if self.fighter is not None:
+            self.game.combat.hp[self.fighter] = value
+
+    def die(self):
+        # a dead unit leaves the game and gives its slot in the combat arrays to the next unit
+        self.remove_goal()
+        self.goal = None
+        self.target = None
+        self.is_selected = False
+        if self.hp_panel is not None:
+            self.hp_panel.kill()
+            self.hp_panel = None
+        self.player.units.remove(self)
+        self.game.collisions.remove(self.rect)
+        self.game.combat.remove(self.fighter)
+        self.fighter = None
+        if self.game.influence is not None:
+            self.game.influence.remove(self)
+        self.kill()
 
     def process(self, delta: float) -> None:
         if self.hp <= 0:
-            if self.goal:
-                if isinstance(self.goal, Collected):
-                    self.goal.stop_collect()
-                self.goal = None
             return
+        if self.goal is not None and not self.goal.alive:
+            self.goal = None
         if self.goal is not None:
             self.follow(self.goal.rect.center)
-        if self.target is not None:
+        if self.target is None:
+            self.path_cell = None
+            self.flow = None
+        else:
             if self.direction is None:
                 self.set_target(self.target)
+            point = self.waypoint()
             self.x += self.direction[0] * delta * self.speed / 1000
             self.y += self.direction[1] * delta * self.speed / 1000
-            if (self.target[0] - self.x) * self.direction[0] < 0:
-                self.x = self.target[0]
+            if (point[0] - self.x) * self.direction[0] < 0:
+                self.x = point[0]
                 self.direction = 0, self.direction[1]
 
-            if (self.target[1] - self.y) * self.direction[1] < 0:
-                self.y = self.target[1]
+            if (point[1] - self.y) * self.direction[1] < 0:
+                self.y = point[1]
                 self.direction = self.direction[0], 0
+            if 0 < abs(self.direction[0]) + abs(self.direction[1]) < 1:
+                # one axis got there, the rest of the way goes at full speed
+                self.aim(point)
+            if self.path and self.direction == (0, 0):
+                # arrived at a waypoint, not at the target, or was pushed aside before getting there
+                self.aim(self.waypoint())
         self.rect.x = self.x
         self.rect.y = self.y
-        ox = -self.direction[0] * self.rect.size[0]
-        oy = -self.direction[1] * self.rect.size[1]
-        if ox or oy:
-            for i in self.game.game_objects:
-                if isinstance(i, Unit) and i != self and self.rect.colliderect(i.rect) and i.direction == (
-                        0, 0) and i.goal is None:
-                    r = i.rect.copy()
-                    r.x += ox
-                    r.y += oy
-                    i.set_target(r)
-
         self.draw()
         Selectable.process(self, delta)
 
+    def separate(self, dx: float, dy: float):
+        # pushed by the units it overlaps, see core.CollisionWorld, but never onto an obstacle or off the level
+        grid = self.game.pathfinder.grid
+        half_w, half_h = self.rect.w // 2, self.rect.h // 2
+        if self.on_obstacle(self.x, self.y):
+            # already stuck there, the push leads to the closest free tile instead of away from the others
+            cell = grid.nearest_free(grid.cell((self.x + half_w, self.y + half_h)))
+            if cell is not None:
+                x, y = grid.center(cell)
+                x, y = x - half_w - self.x, y - half_h - self.y
+                distance = math.hypot(x, y)
+                step = min(distance, math.hypot(dx, dy))
+                dx, dy = (x * step / distance, y * step / distance) if distance else (0, 0)
+        else:
+            if self.on_obstacle(self.x + dx, self.y):
+                dx = 0
+            if self.on_obstacle(self.x + dx, self.y + dy):
+                dy = 0
+        width, height = grid.cols * grid.tile_size, grid.rows * grid.tile_size
+        self.x = min(max(-half_w, self.x + dx), width - 1 - half_w)
+        self.y = min(max(-half_h, self.y + dy), height - 1 - half_h)
+        self.rect.x = self.x
+        self.rect.y = self.y
+
+    def on_obstacle(self, x: float, y: float) -> bool:
+        # whether the center would be on a blocked tile or off the level with the top left corner at x, y
+        grid = self.game.pathfinder.grid
+        center = round(x) + self.rect.w // 2, round(y) + self.rect.h // 2
+        return not grid.contains(center) or grid.is_blocked(grid.cell(center))
+
     def follow(self, target):
         self.target = target
-        x = self.target[0] - self.rect.x
-        y = self.target[1] - self.rect.y
+        self.find_path()
+        self.aim(self.waypoint())
+
+    def aim(self, point):
+        x = point[0] - self.x
+        y = point[1] - self.y
         a = (abs(x) + abs(y))
         if a != 0:
             self.direction = x / a, y / a
 
-    def set_target(self, target):
+    def find_path(self):
+        # target is where the top left corner goes, the path is searched between centers
+        half_w, half_h = self.rect.w / 2, self.rect.h / 2
+        goal = self.target[0] + half_w, self.target[1] + half_h
+        pathfinder = self.game.pathfinder
+        cell = pathfinder.grid.cell(goal)
+        if cell == self.path_cell:
+            return
+        self.path_cell = cell
+        self.path = deque()
+        start = pathfinder.grid.cell(self.rect.center)
+        if abs(start[0] - cell[0]) <= 1 and abs(start[1] - cell[1]) <= 1:
+            # short moves, like being pushed aside, go straight
+            return
+        if self.flow is not None and self.flow.covers(start):
+            return
+        self.flow = None
+        pathfinder.request(self.rect.center, goal, self.set_path, cell)
+
+    def set_path(self, points, cell):
+        if cell != self.path_cell or self.hp <= 0:
+            return
+        half_w, half_h = self.rect.w / 2, self.rect.h / 2
+        self.path = deque((x - half_w, y - half_h) for x, y in points)
+        self.aim(self.waypoint())
+
+    def waypoint(self):
+        # the next point to steer to, waypoints are dropped once the unit got there
+        path = self.path
+        if self.flow is not None and path and self.game.pathfinder.grid.cell(self.rect.center) == self.flow_step:
+            # a step of the field is done on entering its tile, so a group does not squeeze through the tile centers
+            path.clear()
+        while path and abs(path[0][0] - self.x) + abs(path[0][1] - self.y) < self.waypoint_radius:
+            path.popleft()
+            self.aim(path[0] if path else self.target)
+        if not path and self.flow is not None:
+            grid = self.game.pathfinder.grid
+            cell = grid.cell(self.rect.center)
+            step = None
+            if self.flow.is_valid() and self.flow.covers(cell):
+                step = self.flow.step(cell)
+            if step is not None and step != self.flow.goal:
+                self.flow_step = step
+                x, y = grid.center(step)
+                path.append((x - self.rect.w / 2, y - self.rect.h / 2))
+                self.aim(path[0])
+            elif grid.cell((self.target[0] + self.rect.w / 2, self.target[1] + self.rect.h / 2)) != self.flow.goal:
+                # the field went stale, the unit was pushed out of it or it ends short of the unit's formation slot,
+                # the rest of the way is a path of its own
+                self.flow = None
+                self.path_cell = None
+                self.find_path()
+        return path[0] if path else self.target
+
+    def set_target(self, target, flow: pathfinding.FlowField = None):
         self.remove_goal()
+        self.path_cell = None
+        self.flow = flow
         self.follow(target)
 
     def set_goal(self, goal: core.Drawing):
         self.remove_goal()
+        self.path_cell = None
+        self.flow = None
         self.goal = goal
 
     def remove_goal(self):
         if self.goal is not None:
-            self.goal.stop_access()
+            self.goal.stop_access(self)
             self.goal = None
 
 
@@ -511,7 +824,13 @@ class Slave(Unit):
 
     def __init__(self, game, player, left=0, top=0):
         types = ['slave_1', 'slave_2']
-        super().__init__(game, player, random.choice(types), 80, 10, left, top)
+        super().__init__(game, player, game.random.choice(types), 80, 10, left, top)
+
+    def set_goal(self, goal: core.Drawing):
+        super().set_goal(goal)
+        if isinstance(goal, Collected):
+            # reserved while walking there, so no other slave is sent to it
+            goal.reserve(self)
 
     def process(self, delta: float) -> None:
         super().process(delta)
@@ -528,7 +847,7 @@ class Slave(Unit):
                         self.game.set_texts()
                         self.target = None
                         self.remove_goal()
-                    elif self.goal.collector is None:
+                    elif not self.goal.is_collecting:
                         self.goal.start_collect(self)
 
 
@@ -541,7 +860,7 @@ class Wizard(Unit):
 
     def __init__(self, game, player, left=0, top=0):
         types = ['wizard']
-        super().__init__(game, player, random.choice(types), 60, 6, left, top)
+        super().__init__(game, player, game.random.choice(types), 60, 6, left, top)
 
     def process(self, delta: float) -> None:
         super().process(delta)
@@ -550,7 +869,7 @@ class Wizard(Unit):
         if self.goal:
             if isinstance(self.goal, Flammable):
                 if self.rect.colliderect(self.goal.rect):
-                    self.goal.is_burning = True
+                    self.goal.ignite()
                     self.target = None
                     self.goal = None
 
@@ -558,7 +877,6 @@ class Wizard(Unit):
 class Lancer(Unit):
     attack: int = 3
     attack_interval: int = 2000
-    wait_attack: int = 0
     cost = {
         "wood": 0,
         "stone": 0,
@@ -568,38 +886,28 @@ class Lancer(Unit):
     def __init__(self, game, player, speed=90, hp=16, types=None, left=0, top=0):
         if types is None:
             types = ['lancer']
-        super().__init__(game, player, random.choice(types), speed, hp, left, top)
+        super().__init__(game, player, game.random.choice(types), speed, hp, left, top)
 
     def process(self, delta: float) -> None:
         super().process(delta)
         if self.hp <= 0:
             return
-        self.wait_attack -= delta
 
         if self.goal:
             if isinstance(self.goal, Unit):
                 if self.goal.hp <= 0:
                     self.goal = None
                 elif self.rect.colliderect(self.goal.rect):
-                    self.wait_attack -= delta
-                    if self.wait_attack <= 0:
-                        try:
-                            self.goal.blood.play()
-                        except AttributeError:
-                            pass
-                        scream = f'scream_{random.randint(1, 4)}'
-                        self.game.resources.sounds[scream].play()
-                        self.goal.hp -= self.attack
-                        self.wait_attack = self.attack_interval
+                    # the cooldown is checked when the combat resolves the tick's attacks
+                    self.game.combat.strike(self.fighter, self.goal.fighter)
         else:
             if self.direction == (0, 0):
                 md = -1
                 mcol = None
-                for enemy in self.game.game_objects:
-                    if isinstance(enemy,
-                                  Unit) and enemy.player != self.player and enemy.hp > 0:
+                for enemy in self.game.influence.enemies_near(self.player, self.rect.center):
+                    if isinstance(enemy, Unit):
                         d = self.rect.get_distance(enemy.rect)
-                        if (md == -1 or d < md) and d < 50:
+                        if (md == -1 or (d, enemy.seq) < (md, mcol.seq)) and d < 50:
                             md = d
                             mcol = enemy
                 if mcol:
@@ -623,7 +931,7 @@ class King(Unit):
 
     def __init__(self, game, player, left=0, top=0):
         types = ['king']
-        super().__init__(game, player, random.choice(types), 90, 18, left, top)
+        super().__init__(game, player, game.random.choice(types), 90, 18, left, top)
 
     def process(self, delta: float) -> None:
         super().process(delta)
@@ -631,13 +939,22 @@ class King(Unit):
             return
 
 
+# cycles the formation of group orders through formation.SHAPES
+FORMATION_KEY = pygame.K_f
+
+
 class Selection(core.Drawing):
+    events = (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.KEYDOWN)
+    z_index = 6
+    # pixels between the units of a formation
+    formation_gap: int = 8
 
     def __init__(self, game: 'Generals'):
         self.is_active: bool = False
         self.alpha = 50
         self.start_coord = 0, 0
         self.start_camera = 0, 0
+        self.formation = 'box'
         super().__init__(game)
 
     def __bool__(self):
@@ -654,7 +971,11 @@ class Selection(core.Drawing):
 
     def event(self, event) -> None:
         real_mouse = self.game.camera.ui_point_at(self.game.mouse_coord)
-        if event.type == pygame.MOUSEBUTTONDOWN:
+        if event.type == pygame.KEYDOWN:
+            if event.key == FORMATION_KEY:
+                shapes = list(formation.SHAPES)
+                self.formation = shapes[(shapes.index(self.formation) + 1) % len(shapes)]
+        elif event.type == pygame.MOUSEBUTTONDOWN:
             if event.button == 1:
                 self.start(real_mouse)
         elif event.type == pygame.MOUSEBUTTONUP:
@@ -702,14 +1023,38 @@ class Selection(core.Drawing):
                                 for lancer in lancers:
                                     lancer.set_goal(active)
                         if ok:
-                            for sprite in selected_units:
-                                if isinstance(sprite, Unit):
-                                    sprite.set_target(real_mouse)
+                            self.order([i for i in selected_units if isinstance(i, Unit)], real_mouse)
             elif event.button == 3:
                 self.end()
                 for sprite in units:
                     sprite.is_selected = False
 
+    def order(self, units: List['Unit'], point):
+        if not units:
+            return
+        if len(units) == 1:
+            units[0].set_target(point)
+            return
+        # a group shares one flow field instead of searching a path per unit, and spreads out into a formation
+        flow = self.game.pathfinder.flow_field(point, [i.rect.center for i in units])
+        grid = self.game.pathfinder.grid
+        spacing = max(max(i.rect.size) for i in units) + self.formation_gap
+        slots = formation.arrange([i.rect.center for i in units], point, self.formation, spacing)
+        width, height = grid.cols * grid.tile_size, grid.rows * grid.tile_size
+        # tiles given to units whose slot was on an obstacle, so no two of them share one
+        moved = set()
+        for unit, (x, y) in zip(units, slots):
+            half_w, half_h = unit.rect.w / 2, unit.rect.h / 2
+            cell = grid.cell((x, y))
+            if not grid.contains((x, y)) or grid.is_blocked(cell):
+                cell = grid.nearest_free(cell, moved)
+                if cell is not None:
+                    moved.add(cell)
+                    x, y = grid.center(cell)
+            # the unit has to fit inside the level
+            x, y = min(max(half_w, x), width - half_w), min(max(half_h, y), height - half_h)
+            unit.set_target((x - half_w, y - half_h), flow)
+
     def process(self, delta: float) -> None:
         if self.is_active:
             end_coord = self.game.camera.ui_point_at(self.game.mouse_coord)
@@ -779,62 +1124,196 @@ UNITS_KEYS = {
 }
 
 
-class JSONLevelData:
-    def __init__(self):
-        self.width: int
-        self.height: int
-        self.collected
-        self.units
+class Level(core.Object):
 
-
-class LevelJSON(core.Object):
-
-    def __init__(self, game: 'Generals', json_file, tile_size=64):
+    def __init__(self, game: 'Generals', data: level_format.LevelData, tile_size=64):
         super().__init__(game)
         self.tile_size = tile_size
-        data: dict = json.loads(json_file)
-        self.width = data.get('width')
-        self.height = data.get('height')
-
-        camera_pos = data.get('camera_pos')
-        zoom = data.get('base_zoom')
+        self.width = data.width
+        self.height = data.height
 
         self.game.camera.max_x = self.width
         self.game.camera.max_y = self.height
-        self.game.camera.zoom_abs(zoom)
-        self.game.camera.topleft = camera_pos
-
-        fields = [[Field(game, i, j) for j in range((self.height + self.tile_size - 1) // self.tile_size)] for i in
+        self.game.camera.zoom_abs(data.base_zoom)
+        self.game.camera.topleft = data.camera_pos
+
+        if self.game.influence is not None:
+            self.game.influence.task.cancel()
+        self.game.influence = influence.InfluenceMap(
+            self.game, self.width, self.height, [self.game.player, *self.game.bots],
+            lambda unit: unit.hp * unit.attack, self.game.collectables.free)
+        self.game.pathfinder = pathfinding.PathFinder(self.game, pathfinding.Grid(self.width, self.height, tile_size))
+        self.build(data)
+        self.game.influence.update()
+
+    def build(self, data: level_format.LevelData):
+        fields = [[Field(self.game, i, j) for j in range((self.height + self.tile_size - 1) // self.tile_size)] for i in
                   range((self.width + self.tile_size - 1) // self.tile_size)]
-        for i in data.get('collected'):
-            pos = i.get('pos')
-            type = i.get('type')
-            COLLECTED_KEYS[type](game, left=pos[0], top=pos[1])
-        for construction in data.get('constructions'):
-            player_id = construction.get('player')
-            if player_id == 0:
-                player = self.game.player
-            else:
-                player = self.game.bots[player_id % len(self.game.bots)]
-            pos = construction.get('pos')
-            type = construction.get('type')
-            CONSTRUCTION_KEYS[type](game, player, left=pos[0], top=pos[1])
-        for unit in data.get('units'):
-            player_id = unit.get('player')
-            if player_id == 0:
-                player = self.game.player
-            else:
-                player = self.game.bots[player_id % len(self.game.bots)]
-            pos = unit.get('pos')
-            type = unit.get('type')
-            UNITS_KEYS[type](game, player, left=pos[0], top=pos[1])
+        for type, left, top, _ in data.records('collected'):
+            COLLECTED_KEYS[type](self.game, left=left, top=top)
+        self.build_players(data)
+
+    def build_players(self, data: level_format.LevelData):
+        for type, left, top, player_id in data.records('constructions'):
+            CONSTRUCTION_KEYS[type](self.game, self.get_player(player_id), left=left, top=top)
+        for type, left, top, player_id in data.records('units'):
+            UNITS_KEYS[type](self.game, self.get_player(player_id), left=left, top=top)
+
+    def get_player(self, player_id) -> Player:
+        if player_id == 0:
+            return self.game.player
+        return self.game.bots[player_id % len(self.game.bots)]
+
+
+class LevelChunk:
+
+    def __init__(self, key: Tuple[int, int], rect: core.Rect, tiles: List[Tuple[int, int]]):
+        self.key = key
+        self.rect = rect
+        self.tiles = tiles
+        # the serialized content, (type, x, y, player) records as in level_format
+        self.collected = array('i')
+        self.fields: bytes or None = None
+        self.objects: List[core.Object] = []
+        self.active = False
+        self.queued = False
+        self.seen = 0
+
+    def is_idle(self) -> bool:
+        return all(not isinstance(i, Collected) or i.is_idle() for i in self.objects)
+
+
+class StreamedLevel(Level):
+    chunk_tiles: int = 8
+    # objects created per frame while chunks are being activated
+    activation_budget: int = 256
+    # how long an unwatched chunk stays alive before it is packed back
+    idle_time: int = 5000
+
+    def build(self, data: level_format.LevelData):
+        self.time = 0
+        self.chunk_size = self.tile_size * self.chunk_tiles
+        self.chunks: Dict[Tuple[int, int], LevelChunk] = {}
+        self.active_chunks: List[LevelChunk] = []
+        self.queue = deque()
+        tiles_w = (self.width + self.tile_size - 1) // self.tile_size
+        tiles_h = (self.height + self.tile_size - 1) // self.tile_size
+        for x in range((tiles_w + self.chunk_tiles - 1) // self.chunk_tiles):
+            for y in range((tiles_h + self.chunk_tiles - 1) // self.chunk_tiles):
+                tiles = [(i, j)
+                         for i in range(x * self.chunk_tiles, min(tiles_w, (x + 1) * self.chunk_tiles))
+                         for j in range(y * self.chunk_tiles, min(tiles_h, (y + 1) * self.chunk_tiles))]
+                rect = core.Rect(x * self.chunk_size, y * self.chunk_size, self.chunk_size, self.chunk_size)
+                self.chunks[x, y] = LevelChunk((x, y), rect, tiles)
+        for record in data.records('collected'):
+            self.chunk_at(record[1:3]).collected.extend(record)
+        self.build_players(data)
+        for chunk in self.visible_chunks():
+            self.activate(chunk)
+
+    def chunk_at(self, point) -> LevelChunk:
+        x = min(max(0, int(point[0]) // self.chunk_size), (self.width - 1) // self.chunk_size)
+        y = min(max(0, int(point[1]) // self.chunk_size), (self.height - 1) // self.chunk_size)
+        return self.chunks[x, y]
+
+    def chunks_in(self, rect: core.Rect) -> Iterator[LevelChunk]:
+        left, top = self.chunk_at(rect.topleft).key
+        right, bottom = self.chunk_at(rect.bottomright).key
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                yield self.chunks[x, y]
+
+    def visible_chunks(self) -> Iterator[LevelChunk]:
+        return self.chunks_in(self.game.camera)
+
+    def wanted_chunks(self) -> List[LevelChunk]:
+        # the visible chunks come first so they are activated first
+        wanted = list(self.visible_chunks())
+        camera = self.game.camera.inflate(self.chunk_size, self.chunk_size)
+        wanted.extend(self.chunks_in(camera))
+        for player in (self.game.player, *self.game.bots):
+            for unit in player.units:
+                if isinstance(unit, Unit) and unit.hp > 0:
+                    wanted.append(self.chunk_at(unit.rect.center))
+        return wanted
+
+    def activate(self, chunk: LevelChunk) -> int:
+        if chunk.fields is None:
+            chunk.fields = bytes(self.game.random.randrange(len(Field.fields)) for _ in chunk.tiles)
+        for (i, j), field in zip(chunk.tiles, chunk.fields):
+            chunk.objects.append(Field(self.game, i, j, Field.fields[field]))
+        for type, left, top, _ in level_format.records(chunk.collected):
+            chunk.objects.append(COLLECTED_KEYS[type](self.game, left=left, top=top))
+        chunk.active = True
+        chunk.seen = self.time
+        self.active_chunks.append(chunk)
+        return len(chunk.objects)
+
+    def deactivate(self, chunk: LevelChunk):
+        for i in chunk.objects:
+            i.kill()
+        chunk.objects = []
+        chunk.active = False
+        self.active_chunks.remove(chunk)
+
+    def process(self, delta: float) -> None:
+        self.time += delta
+        for chunk in self.wanted_chunks():
+            chunk.seen = self.time
+            if not chunk.active and not chunk.queued:
+                chunk.queued = True
+                self.queue.append(chunk)
+        budget = self.activation_budget
+        while self.queue and budget > 0:
+            chunk = self.queue.popleft()
+            chunk.queued = False
+            if not chunk.active:
+                budget -= self.activate(chunk)
+        for chunk in tuple(self.active_chunks):
+            if self.time - chunk.seen > self.idle_time and chunk.is_idle():
+                self.deactivate(chunk)
+
+
+class LevelJSON(Level):
+
+    def __init__(self, game: 'Generals', json_file, tile_size=64):
+        super().__init__(game, level_format.from_json(json_file), tile_size)
+
+
+class LevelBinary(Level):
+
+    def __init__(self, game: 'Generals', binary: bytes, tile_size=64):
+        super().__init__(game, level_format.from_binary(binary), tile_size)
+
+
+# levels at least this large (in square pixels) are streamed by chunks
+STREAMED_LEVEL_AREA = 2048 * 2048
+
+
+def load_level(game: 'Generals', path: str, tile_size=64, streamed: bool = None) -> Level:
+    return create_level(game, level_format.load(path), tile_size, streamed)
+
+
+def create_level(game: 'Generals', data: level_format.LevelData, tile_size=64, streamed: bool = None) -> Level:
+    if streamed is None:
+        streamed = data.width * data.height >= STREAMED_LEVEL_AREA
+    if streamed:
+        return StreamedLevel(game, data, tile_size)
+    return Level(game, data, tile_size)
 
 
 class Generals(core.Game):
+    events = (pygame.MOUSEBUTTONDOWN, combat.DAMAGE, combat.DEATH)
 
-    def __init__(self, window_size, viewport_size, title, icon, full_screen):
-        super().__init__(window_size, viewport_size, title, icon, full_screen, 60)
+    def __init__(self, window_size, viewport_size, title, icon, full_screen, seed: int = None):
+        super().__init__(window_size, viewport_size, title, icon, full_screen, 60, seed)
         pygame.font.init()
+        self.combat: combat.Combat = combat.Combat(self)
+        # one emitter bleeds for every unit that is hit
+        self.blood: Particles = Particles(self, (0, 0), 'blood', min_scale=0.05, max_scale=0.1)
+        self.collectables: CollectedIndex = CollectedIndex()
+        self.influence: influence.InfluenceMap or None = None
+        self.pathfinder: pathfinding.PathFinder or None = None
         self.selection: Selection or None = None
         self.player: Player = Player(self, 'blue')
         self.bots: List[Bot] = [Bot(self, 'red')]
@@ -846,14 +1325,34 @@ class Generals(core.Game):
         self.food = core.Text(self, "Montserrat_16", color=(255, 255, 255))
         self.set_texts()
 
-        self.resources.sounds['music'].play()
-        self.resources.sounds['music'].set_volume(0.3)
+        self.music = core.Music(self, volume=0.3)
+        self.music.set_playlist(['music'])
+
+        self.overlay = diagnostics.PerformanceOverlay(self, "Montserrat_16")
+        self.overlay.add_counter('particles', lambda: sum(isinstance(i, Particle) for i in self.game_objects))
+        self.overlay.add_cache('paths', lambda: self.pathfinder.stats() if self.pathfinder else (0, 0))
+        self.overlay.add_cache('flow fields', lambda: self.pathfinder.field_stats() if self.pathfinder else (0, 0))
+        self.overlay.add_counter('collisions', lambda: f'{self.collisions.contacts} of {self.collisions.checks} pairs')
+        self.overlay.add_counter('hits', lambda: self.combat.hits)
+        self.overlay.add_counter('ai tasks', lambda: f'{self.ai.ran}/frame, {self.ai.late} late')
+        if os.environ.get('ZULU_DOODMAAK_LEAKS'):
+            self.leaks = diagnostics.LeakTracker(self)
+            self.leaks.add_check('dead units', lambda: sum(
+                isinstance(i, Selectable) and i.hp <= 0 for i in self.game_objects))
 
     def event(self, event) -> None:
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 4:  # wheel rolled up
             self.camera.zoom(0.1)
         elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 5:  # wheel rolled down
             self.camera.zoom(-0.1)
+        elif event.type == combat.DAMAGE:
+            target = event.target
+            self.blood.play_at(target.rect.center, target.rect)
+            scream = f'scream_{self.random.randint(1, 4)}'
+            self.resources.sounds[scream].play_at(target.rect.center)
+        elif event.type == combat.DEATH:
+            self.tracer.instant('death', {'unit': type(event.unit).__name__, 'player': event.unit.player.color})
+            event.unit.die()
 
     def load_resources(self):
         animations = {
@@ -921,22 +1420,23 @@ class Generals(core.Game):
             'icon': ('icon.png',),
         }
         sounds = {
-            'music': 'Sounds/music.wav',
-
-            'scream_1': 'Sounds/screams/1.wav',
-            'scream_2': 'Sounds/screams/2.wav',
-            'scream_3': 'Sounds/screams/3.wav',
-            'scream_4': 'Sounds/screams/4.wav',
+            'scream_1': ('sounds/screams/1.wav', 'scream'),
+            'scream_2': ('sounds/screams/2.wav', 'scream'),
+            'scream_3': ('sounds/screams/3.wav', 'scream'),
+            'scream_4': ('sounds/screams/4.wav', 'scream'),
         }
+        self.mixer.add_group('scream', 4, cooldown=100)
         self.resources.load_animations(animations)
         self.resources.load_font('Montserrat', 'Montserrat.ttf')
         self.resources.load_font('Montserrat_16', 'Montserrat.ttf', size=16)
         self.resources.load_sounds(sounds)
+        self.resources.load_music('music', 'sounds/music.wav')
 
-    def start(self, fill=None):
+    def start(self, fill=None, realtime: bool = True):
         self.selection: Selection = Selection(self)
         self.cursor: Cursor = Cursor(self)
-        super().start(fill)
+        self.music.play()
+        super().start(fill, realtime)
 
     def set_texts(self):
         self.wood.set_text(
@@ -973,14 +1473,21 @@ RESOLUTIONS = {
 }
 
 
+FILL = (10, 255, 255)
+
+
+def create_game(window_size, viewport_size, full_screen: bool = True, seed: int = None,
+                level: str = 'levels/1.json') -> Generals:
+    game = Generals(window_size, viewport_size, "zulu-doodmaak", "icon", full_screen, seed)
+    load_level(game, level)
+    return game
+
+
 def main():
     default_screensize = get_system_screensize()
-    window_size = default_screensize
-    viewport_size = default_screensize
-    title = "zulu-doodmaak"
-    icon = "icon"
-    full_screen = True
-    game = Generals(window_size, viewport_size, title, icon, full_screen)
-    json_data = open('levels/1.json').read()
-    level = LevelJSON(game, json_data)
-    game.start((10, 255, 255))
+    level = 'levels/1.json'
+    game = create_game(default_screensize, default_screensize, True, level=level)
+    record = os.environ.get('ZULU_DOODMAAK_RECORD')
+    if record:
+        game.record(record, level)
+    game.start(FILL)
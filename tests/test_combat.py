@@ -0,0 +1,83 @@
+import gc
+import os
+import weakref
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+@pytest.fixture
+def game(monkeypatch):
+    pytest.importorskip('numpy')
+    pytest.importorskip('simpleaudio')
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+    from src import benchmark, level_generator, zulu_doodmaak
+
+    # the game loads its resources relative to the repository
+    monkeypatch.chdir(ROOT)
+    pygame.init()
+    game = benchmark.BenchmarkGame((1280, 720))
+    generator = level_generator.LevelGenerator(1024, 1024, 0, 2, army_radius=100)
+    zulu_doodmaak.create_level(game, generator.generate({}, {}, {1: 8}))
+    game.add_controls()
+    return game
+
+
+def lancers(game):
+    """A lancer of the player and one of the bot."""
+    from src import zulu_doodmaak
+    units = [i for i in game.game_objects if isinstance(i, zulu_doodmaak.Lancer)]
+    return (next(i for i in units if i.player is game.player),
+            next(i for i in units if i.player is game.bots[0]))
+
+
+def kill(game, unit, killer):
+    unit.hp = 1
+    game.combat.strike(killer.fighter, unit.fighter)
+    for _ in range(10):
+        game.frame(1000 / 60, (0, 0, 0))
+        if unit not in game.game_objects:
+            return
+    pytest.fail('the unit did not die')
+
+
+def test_dead_unit_is_released(game):
+    def fight():
+        # the unit is only referenced from this frame, which is gone once it returns
+        killer, unit = lancers(game)
+        kill(game, unit, killer)
+        return weakref.ref(unit)
+
+    fighter = lancers(game)[1].fighter
+    dead = fight()
+    gc.collect()
+    assert dead() is None
+    assert game.combat.fighters[fighter] is None
+    assert fighter in game.combat.free
+
+
+def test_freed_slot_is_reused(game):
+    from src import zulu_doodmaak
+    killer, unit = lancers(game)
+    fighter, size = unit.fighter, len(game.combat.fighters)
+    kill(game, unit, killer)
+    assert unit.hp == 0
+    spawned = zulu_doodmaak.Lancer(game, game.bots[0])
+    assert spawned.fighter == fighter
+    assert len(game.combat.fighters) == size
+    assert spawned.hp > 0
+
+
+def test_intents_on_a_freed_slot_do_not_land(game):
+    from src import zulu_doodmaak
+    killer, unit = lancers(game)
+    game.combat.strike(killer.fighter, unit.fighter)
+    game.combat.remove(unit.fighter)
+    spawned = zulu_doodmaak.Lancer(game, game.bots[0])
+    hp = spawned.hp
+    game.combat.process(0)
+    assert game.combat.hits == 0
+    assert spawned.hp == hp
@@ -0,0 +1,63 @@
+import glob
+import os
+
+import pytest
+
+from src import level_format
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LEVELS = sorted(glob.glob(os.path.join(ROOT, 'levels', '*.json')))
+
+
+def read(path: str) -> str:
+    with open(path, encoding='utf-8') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('path', LEVELS)
+def test_binary_round_trip(path):
+    level = level_format.from_json(read(path))
+    binary = level_format.to_binary(level)
+    assert level_format.from_binary(binary) == level
+    assert level_format.from_json(level_format.to_json(level_format.from_binary(binary))) == level
+
+
+@pytest.mark.parametrize('path', LEVELS)
+def test_truncated_binary(path):
+    binary = level_format.to_binary(level_format.from_json(read(path)))
+    for size in (0, level_format.HEADER.size - 1, len(binary) - 1):
+        with pytest.raises(ValueError):
+            level_format.from_binary(binary[:size])
+    with pytest.raises(ValueError):
+        level_format.from_binary(binary + b'\0')
+
+
+def test_bad_magic():
+    binary = bytearray(level_format.to_binary(level_format.LevelData(64, 64)))
+    binary[:4] = b'ABCD'
+    with pytest.raises(ValueError):
+        level_format.from_binary(bytes(binary))
+
+
+@pytest.mark.parametrize('path', LEVELS)
+def test_loaders_build_the_same_objects(path, monkeypatch):
+    pytest.importorskip('numpy')
+    pytest.importorskip('simpleaudio')
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+    from src import benchmark, zulu_doodmaak
+
+    def build(level_class, source):
+        game = benchmark.BenchmarkGame((1280, 720), 0)
+        level_class(game, source)
+        return [(type(obj).__name__, tuple(obj.rect) if getattr(obj, 'rect', None) is not None else None,
+                 getattr(getattr(obj, 'player', None), 'color', None)) for obj in game.game_objects
+                if not isinstance(obj, zulu_doodmaak.Level)]
+
+    # the game loads its resources relative to the repository
+    monkeypatch.chdir(ROOT)
+    pygame.init()
+    text = read(path)
+    objects = build(zulu_doodmaak.LevelJSON, text)
+    assert objects == build(zulu_doodmaak.LevelBinary, level_format.to_binary(level_format.from_json(text)))
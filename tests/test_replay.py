@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from src import replay
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LEVEL = 'levels/1.json'
+
+
+@pytest.fixture
+def pygame():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+    # get_pressed() only maps keycodes to scancodes once the video system is up
+    pygame.init()
+    return pygame
+
+
+def held(pygame, key):
+    """What pygame.key.get_pressed() returns while only key is held."""
+    for scancode in range(512):
+        keys = pygame.key.ScancodeWrapper(tuple(i == scancode for i in range(512)))
+        if keys[key]:
+            return keys
+    pytest.fail(f'no scancode for {pygame.key.name(key)}')
+
+
+def test_recorded_keys_answer_keycodes(pygame):
+    recording = replay.Replay(0, LEVEL, (1280, 720), (1280, 720))
+    recorder = replay.Recorder(recording)
+    keys = held(pygame, pygame.K_LSHIFT)
+    recorder.end_tick(16, (0, 0), keys)
+    player = replay.Player(recording)
+    player.events(0)
+    assert keys[pygame.K_LSHIFT]
+    assert player.keys[pygame.K_LSHIFT]
+    assert not player.keys[pygame.K_RSHIFT]
+
+
+def test_shift_box_selection_replays(pygame, tmp_path, monkeypatch):
+    pytest.importorskip('numpy')
+    pytest.importorskip('simpleaudio')
+    from src import benchmark, zulu_doodmaak
+
+    def session(game, steps):
+        # steps of (mouse, keys, events), the mouse has to move between pressing and releasing for a box
+        for mouse, keys, events in steps:
+            game.read_input = lambda: (mouse, keys)
+            for event in events:
+                pygame.event.post(event)
+            game.frame(16, zulu_doodmaak.FILL)
+        return [unit.is_selected for unit in game.player.units]
+
+    def new_game(seed):
+        game = benchmark.BenchmarkGame((1280, 720), seed)
+        zulu_doodmaak.load_level(game, LEVEL)
+        game.add_controls()
+        return game
+
+    # the game loads its resources relative to the repository
+    monkeypatch.chdir(ROOT)
+    none, shift = pygame.key.ScancodeWrapper((False,) * 512), held(pygame, pygame.K_LSHIFT)
+    down, up = pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP
+    steps = [
+        # select every unit on screen, then add an empty box to the selection with shift held
+        ((0, 0), none, [pygame.event.Event(down, button=1, pos=(0, 0))]),
+        ((1279, 719), none, []),
+        ((1279, 719), none, [pygame.event.Event(up, button=1, pos=(1279, 719))]),
+        ((2, 2), shift, [pygame.event.Event(down, button=1, pos=(2, 2))]),
+        ((40, 40), shift, []),
+        ((40, 40), shift, [pygame.event.Event(up, button=1, pos=(40, 40))]),
+        ((40, 40), none, []),
+    ]
+    game = new_game(1)
+    path = str(tmp_path / 'shift.zdr')
+    game.record(path, LEVEL)
+    selected = session(game, steps)
+    game.recorder.save()
+    assert any(selected)
+
+    recording = replay.Replay.load(path)
+    game = new_game(recording.seed)
+    game.play(recording)
+    game.running = True
+    while game.running:
+        game.frame(0, zulu_doodmaak.FILL)
+    assert [unit.is_selected for unit in game.player.units] == selected